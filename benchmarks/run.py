@@ -0,0 +1,190 @@
+"""Measure the throughput of QuetzClient against the local stand-in server.
+
+Every scenario reports requests/s, MB/s, the p50/p99 request latency and the
+peak resident memory of the benchmark process. The server runs in a separate
+process so that its memory and CPU use do not distort the client numbers.
+
+    python benchmarks/run.py --latency 0.005 --packages 5000
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from functools import partial
+from pathlib import Path
+from statistics import quantiles
+from typing import Callable, List
+
+import requests
+
+from quetz_client.client import QuetzClient
+
+sys.path.insert(0, str(Path(__file__).parent))
+from server import Dataset, make_server  # noqa: E402
+
+
+@dataclass
+class Result:
+    scenario: str
+    requests: int
+    seconds: float
+    requests_per_second: float
+    megabytes_per_second: float
+    p50_latency_ms: float
+    p99_latency_ms: float
+    peak_rss_mb: float
+
+
+def _serve(dataset: Dataset, latency: float, port_queue) -> None:
+    server = make_server(dataset.build(), latency=latency)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def measure(scenario: str, client: QuetzClient, run: Callable[[], int]) -> Result:
+    """Run a scenario; `run` returns the number of payload bytes transferred"""
+    latencies: List[float] = []
+
+    def record(response: requests.Response, *args, **kwargs) -> None:
+        latencies.append(response.elapsed.total_seconds())
+
+    client.session.hooks["response"].append(record)
+    try:
+        start = time.perf_counter()
+        n_bytes = run()
+        seconds = time.perf_counter() - start
+    finally:
+        client.session.hooks["response"].remove(record)
+
+    percentiles = quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return Result(
+        scenario=scenario,
+        requests=len(latencies),
+        seconds=round(seconds, 3),
+        requests_per_second=round(len(latencies) / seconds, 1),
+        megabytes_per_second=round(n_bytes / 1024**2 / seconds, 1),
+        p50_latency_ms=round(percentiles[49] * 1000, 2),
+        p99_latency_ms=round(percentiles[98] * 1000, 2),
+        peak_rss_mb=round(_peak_rss_mb(), 1),
+    )
+
+
+def run_benchmarks(args: argparse.Namespace, url: str) -> List[Result]:
+    client = QuetzClient.from_token(
+        url, "benchmark", pool_maxsize=max(args.workers, 10)
+    )
+    results = []
+
+    def listing(**kwargs) -> Callable[[], int]:
+        def run() -> int:
+            packages = list(client.yield_packages("channel0", **kwargs))
+            return sum(len(json.dumps(asdict(p))) for p in packages)
+
+        return run
+
+    results.append(measure("list packages", client, listing(limit=args.limit)))
+    results.append(
+        measure(
+            f"list packages (prefetch={args.workers})",
+            client,
+            listing(limit=args.limit, prefetch=args.workers),
+        )
+    )
+    results.append(
+        measure(
+            "list users",
+            client,
+            lambda: len(list(client.yield_users(limit=args.limit))),
+        )
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for size_mb in args.file_sizes:
+            files = []
+            for i in range(args.files):
+                path = Path(tmp) / f"upload{size_mb}mb{i}-1.0-0.tar.bz2"
+                path.write_bytes(b"\0" * int(size_mb * 1024**2))
+                files.append(path)
+
+            def upload(files: List[Path] = files, zero_copy: bool = False) -> int:
+                client.post_files_to_channel(
+                    "upload", files, max_workers=args.workers, zero_copy=zero_copy
+                )
+                return sum(f.stat().st_size for f in files)
+
+            results.append(
+                measure(f"upload {args.files} x {size_mb} MB", client, upload)
+            )
+            results.append(
+                measure(
+                    f"upload {args.files} x {size_mb} MB (zero-copy)",
+                    client,
+                    partial(upload, zero_copy=True),
+                )
+            )
+
+        def download() -> int:
+            client.download_channel("channel0", tmp, max_workers=args.workers)
+            return sum(f.stat().st_size for f in Path(tmp, "noarch").iterdir())
+
+        results.append(measure("download channel", client, download))
+
+    def sync_members() -> int:
+        desired = {f"user{i}": "maintainer" for i in range(args.users)}
+        client.sync_channel_members("channel1", desired, max_workers=args.workers)
+        return 0
+
+    results.append(measure(f"sync {args.users} members", client, sync_members))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--packages", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=50, help="page size")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--files", type=int, default=8, help="files per upload")
+    parser.add_argument(
+        "--file-sizes", type=float, nargs="+", default=[1, 16], help="in MB"
+    )
+    parser.add_argument("--json", action="store_true", help="print JSON lines")
+    args = parser.parse_args()
+
+    dataset = Dataset(
+        channels=2, packages=args.packages, users=args.users, files_per_channel=16
+    )
+    port_queue: "multiprocessing.Queue[int]" = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=_serve, args=(dataset, args.latency, port_queue), daemon=True
+    )
+    server.start()
+    try:
+        results = run_benchmarks(args, f"http://127.0.0.1:{port_queue.get()}")
+    finally:
+        server.terminate()
+
+    if args.json:
+        for result in results:
+            print(json.dumps(asdict(result)))
+        return
+    header = list(asdict(results[0]))
+    rows = [header] + [[str(v) for v in asdict(r).values()] for r in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    for row in rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""A scriptable stand-in for a Quetz server, used by the benchmarks.
+
+The server implements the subset of the Quetz API used by `QuetzClient` on top
+of in-memory data. Every response can be delayed by a fixed latency to
+simulate a remote server. Run it standalone with
+
+    python benchmarks/server.py --port 8000 --channels 10 --packages 1000
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+SUBDIR = "noarch"
+
+
+@dataclass
+class Dataset:
+    """The channels, packages, users and files served by the stand-in server"""
+
+    channels: int = 10
+    packages: int = 100
+    users: int = 100
+    members: int = 10
+    file_size: int = 1024 * 1024
+    files_per_channel: int = 10
+    # Filled in by `build`
+    channel_list: List[Dict] = field(default_factory=list)
+    package_lists: Dict[str, List[Dict]] = field(default_factory=dict)
+    user_list: List[Dict] = field(default_factory=list)
+    member_lists: Dict[str, Dict[str, str]] = field(default_factory=dict)
+    files: Dict[str, Dict[str, bytes]] = field(default_factory=dict)
+
+    def build(self) -> "Dataset":
+        self.user_list = [
+            {
+                "id": str(i),
+                "username": f"user{i}",
+                "profile": {"name": f"User {i}", "avatar_url": "/avatar.jpg"},
+            }
+            for i in range(self.users)
+        ]
+        content = bytes(range(256)) * (self.file_size // 256)
+        for c in range(self.channels):
+            name = f"channel{c}"
+            self.channel_list.append(
+                {
+                    "name": name,
+                    "description": f"Channel {c}",
+                    "private": c % 2 == 0,
+                    "size_limit": None,
+                    "ttl": 36000,
+                    "mirror_channel_url": None,
+                    "mirror_mode": None,
+                    "members_count": self.members,
+                    "packages_count": self.packages,
+                }
+            )
+            self.package_lists[name] = [
+                {
+                    "name": f"package{p}",
+                    "summary": f"Summary {p}",
+                    "description": f"Description {p}",
+                    "url": f"https://example.com/package{p}",
+                    "platforms": [SUBDIR],
+                    "current_version": f"1.0.{p}",
+                    "latest_change": f"2023-01-01T00:00:{p % 60:02d}.{p:06d}+00:00",
+                }
+                for p in range(self.packages)
+            ]
+            self.member_lists[name] = {
+                u["username"]: "member" for u in self.user_list[: self.members]
+            }
+            self.files[name] = {
+                f"package{f}-1.0-0.tar.bz2": content
+                for f in range(self.files_per_channel)
+            }
+        return self
+
+
+def _paginated(records: List[Dict], query: Dict[str, List[str]]) -> Dict:
+    skip = int(query.get("skip", ["0"])[0])
+    limit = int(query.get("limit", ["10"])[0])
+    q = query.get("q", [""])[0]
+    if q:
+        records = [r for r in records if q in r.get("name", r.get("username", ""))]
+    return {
+        "pagination": {"skip": skip, "limit": limit, "all_records_count": len(records)},
+        "result": records[skip : skip + limit],
+    }
+
+
+def make_handler(dataset: Dataset, latency: float):
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def _send(self, status: int, body: Optional[object] = None) -> None:
+            if latency:
+                time.sleep(latency)
+            payload = b"" if body is None else json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _send_bytes(self, content: bytes) -> None:
+            if latency:
+                time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def _read_body(self) -> bytes:
+            if self.headers.get("Transfer-Encoding") == "chunked":
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().strip(), 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        break
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+                return b"".join(chunks)
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def _route(self) -> Tuple[str, Dict[str, List[str]]]:
+            url = urlparse(self.path)
+            return url.path, parse_qs(url.query)
+
+        def do_GET(self) -> None:
+            path, query = self._route()
+            if path == "/api/paginated/channels":
+                return self._send(200, _paginated(dataset.channel_list, query))
+            if path == "/api/paginated/users":
+                return self._send(200, _paginated(dataset.user_list, query))
+            match = re.fullmatch(r"/api/paginated/channels/([^/]+)/packages", path)
+            if match:
+                packages = dataset.package_lists.get(match[1], [])
+                if query.get("order_by") == ["latest_change:desc"]:
+                    packages = sorted(
+                        packages, key=lambda p: p["latest_change"], reverse=True
+                    )
+                return self._send(200, _paginated(packages, query))
+            match = re.fullmatch(r"/api/channels/([^/]+)/members", path)
+            if match:
+                users = {u["username"]: u for u in dataset.user_list}
+                with lock:
+                    members = dict(dataset.member_lists.get(match[1], {}))
+                return self._send(
+                    200,
+                    [
+                        {"role": role, "user": users[username]}
+                        for username, role in members.items()
+                    ],
+                )
+            match = re.fullmatch(r"/api/users/([^/]+)/role", path)
+            if match:
+                return self._send(200, {"role": "member"})
+            match = re.fullmatch(r"/get/([^/]+)/channeldata.json", path)
+            if match:
+                return self._send(200, {"subdirs": [SUBDIR]})
+            match = re.fullmatch(r"/get/([^/]+)/([^/]+)/repodata.json", path)
+            if match:
+                with lock:
+                    files = dict(dataset.files.get(match[1], {}))
+                repodata = {
+                    name: {"sha256": hashlib.sha256(content).hexdigest()}
+                    for name, content in files.items()
+                }
+                return self._send(200, {"packages": repodata, "packages.conda": {}})
+            match = re.fullmatch(r"/get/([^/]+)/([^/]+)/([^/]+)", path)
+            if match and match[3] in dataset.files.get(match[1], {}):
+                return self._send_bytes(dataset.files[match[1]][match[3]])
+            self._send(404, {"detail": "Not Found"})
+
+        def do_POST(self) -> None:
+            path, query = self._route()
+            body = self._read_body()
+            match = re.fullmatch(r"/api/channels/([^/]+)/upload/([^/]+)", path)
+            if match:
+                if hashlib.sha256(body).hexdigest() != query.get("sha256", [""])[0]:
+                    return self._send(400, {"detail": "Wrong SHA256 checksum"})
+                with lock:
+                    dataset.files.setdefault(match[1], {})[match[2]] = body
+                return self._send(201)
+            match = re.fullmatch(r"/api/channels/([^/]+)/members", path)
+            if match:
+                member = json.loads(body)
+                with lock:
+                    members = dataset.member_lists.setdefault(match[1], {})
+                    if member["username"] in members:
+                        return self._send(409, {"detail": "Member exists"})
+                    members[member["username"]] = member["role"]
+                return self._send(201)
+            self._send(404, {"detail": "Not Found"})
+
+        def do_DELETE(self) -> None:
+            path, query = self._route()
+            match = re.fullmatch(r"/api/channels/([^/]+)/members", path)
+            if match:
+                with lock:
+                    members = dataset.member_lists.get(match[1], {})
+                    members.pop(query.get("username", [""])[0], None)
+                return self._send(200)
+            self._send(404, {"detail": "Not Found"})
+
+    return Handler
+
+
+def make_server(
+    dataset: Dataset, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0
+) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), make_handler(dataset, latency))
+    server.daemon_threads = True
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--packages", type=int, default=100)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--members", type=int, default=10)
+    args = parser.parse_args()
+    dataset = Dataset(
+        channels=args.channels,
+        packages=args.packages,
+        users=args.users,
+        members=args.members,
+    ).build()
+    server = make_server(dataset, latency=args.latency, port=args.port)
+    print(f"Serving on http://127.0.0.1:{server.server_address[1]}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,16 @@
-from .client import QuetzClient
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .client import QuetzClient
 
 __all__ = ("QuetzClient",)
+
+
+def __getattr__(name: str):
+    # Import the client (and thus `requests`) only when it is used, which keeps
+    # the startup of the CLI fast.
+    if name == "QuetzClient":
+        from .client import QuetzClient
+
+        return QuetzClient
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
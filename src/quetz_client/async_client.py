@@ -0,0 +1,373 @@
+import asyncio
+from dataclasses import dataclass
+from itertools import count
+from pathlib import Path
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+import httpx
+
+from quetz_client.client import (
+    _CHUNK_SIZE,
+    _ORDER_BY_LATEST_CHANGE,
+    Channel,
+    ChannelFile,
+    ChannelMember,
+    FileResult,
+    Package,
+    Role,
+    User,
+    _assert_file_is_package,
+    _channel_matches,
+    _decode_channel,
+    _decode_channel_member,
+    _decode_package,
+    _decode_user,
+    _package_matches,
+    _parse_timestamp,
+    _sha256_of_file,
+)
+from quetz_client.ratelimit import RateLimiter, request_kind
+from quetz_client.validation import validate_package
+
+
+async def _read_chunks(
+    file: Path, chunk_size: int = _CHUNK_SIZE
+) -> AsyncIterator[bytes]:
+    """Read a file in fixed-size chunks without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    with file.open("rb") as f:
+        while True:
+            chunk = await loop.run_in_executor(None, f.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+@dataclass
+class AsyncQuetzClient:
+    """Asynchronous counterpart of `QuetzClient` built on `httpx`.
+
+    All requests share one `httpx.AsyncClient` and thus its connection pool,
+    so many calls can be awaited concurrently. Use the client as an async
+    context manager or call `aclose` to release the connections.
+    """
+
+    session: httpx.AsyncClient
+    url: str
+    # May be shared with `QuetzClient`s running in other threads
+    rate_limiter: Optional[RateLimiter] = None
+
+    @classmethod
+    def from_token(
+        cls,
+        url: str,
+        token: str,
+        max_connections: int = 100,
+        timeout: Optional[Union[float, Tuple[Optional[float], Optional[float]]]] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+    ) -> "AsyncQuetzClient":
+        """Create a client authenticating with an API key.
+
+        `timeout` is either a single timeout or (connect, read), like for
+        `QuetzClient.from_token`. Unlike httpx, requests never time out by
+        default.
+        """
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            http_timeout = httpx.Timeout(None, connect=connect, read=read)
+        else:
+            http_timeout = httpx.Timeout(timeout)
+        session = httpx.AsyncClient(
+            headers={"X-API-Key": token}, limits=limits, timeout=http_timeout
+        )
+        return cls(session, url=url, rate_limiter=rate_limiter)
+
+    async def aclose(self) -> None:
+        await self.session.aclose()
+
+    async def __aenter__(self) -> "AsyncQuetzClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        content_factory: Optional[Callable[[], AsyncIterator[bytes]]] = None,
+        **kwargs,
+    ) -> httpx.Response:
+        # Streamed bodies are passed as a factory so that retries can start over
+        if content_factory is not None:
+            kwargs["content"] = content_factory()
+        if self.rate_limiter is None:
+            return await self.session.request(method, url, **kwargs)
+        kind = request_kind(method, url)
+        attempt = 0
+        while True:
+            async with self.rate_limiter.limit_async(kind):
+                response = await self.session.request(method, url, **kwargs)
+            if not self.rate_limiter.backoff(
+                kind, response.status_code, response.headers, attempt
+            ):
+                return response
+            attempt += 1
+            if content_factory is not None:
+                kwargs["content"] = content_factory()
+
+    async def _yield_paginated(
+        self, url: str, params: Dict[str, Union[str, int]], limit: int = 20
+    ) -> AsyncIterator[Dict]:
+        params = {**params, "limit": limit}
+        for skip in count(step=limit):
+            params["skip"] = skip
+            response = await self._request("GET", url, params=params)
+            response.raise_for_status()
+            result = response.json()["result"]
+            if not result:
+                break
+            for item in result:
+                yield item
+
+    async def yield_channels(
+        self,
+        query: str = "",
+        limit: int = 20,
+        private: Optional[bool] = None,
+        mirror_mode: Optional[str] = None,
+        name_prefix: str = "",
+    ) -> AsyncIterator[Channel]:
+        url = f"{self.url}/api/paginated/channels"
+        params: Dict[str, Union[str, int]] = {
+            "q": query or name_prefix,
+            "public": True,  # include public channels
+        }
+        async for channel_json in self._yield_paginated(
+            url=url, params=params, limit=limit
+        ):
+            if _channel_matches(channel_json, private, mirror_mode, name_prefix):
+                yield _decode_channel(channel_json)
+
+    async def yield_channel_members(self, channel: str) -> AsyncIterator[ChannelMember]:
+        url = f"{self.url}/api/channels/{channel}/members"
+        response = await self._request("GET", url)
+        response.raise_for_status()
+        for member_json in response.json():
+            yield _decode_channel_member(member_json)
+
+    async def yield_users(
+        self, query: str = "", limit: int = 20
+    ) -> AsyncIterator[User]:
+        url = f"{self.url}/api/paginated/users"
+        params: Dict[str, Union[str, int]] = {
+            "q": query,
+        }
+        async for user_json in self._yield_paginated(
+            url=url, params=params, limit=limit
+        ):
+            yield _decode_user(user_json)
+
+    async def get_role(self, user: str) -> Role:
+        url = f"{self.url}/api/users/{user}/role"
+        response = await self._request("GET", url)
+        response.raise_for_status()
+        return Role(response.json()["role"])
+
+    async def set_channel_member(
+        self, user: str, role: Optional[str], channel: str
+    ) -> None:
+        url = f"{self.url}/api/channels/{channel}/members"
+        response = await self._request(
+            "POST", url, json={"username": user, "role": role}
+        )
+        response.raise_for_status()
+
+    async def delete_channel_member(self, user: str, channel: str) -> None:
+        url = f"{self.url}/api/channels/{channel}/members"
+        response = await self._request("DELETE", url, params={"username": user})
+        response.raise_for_status()
+
+    async def set_role(self, user: str, role: Optional[str]) -> None:
+        url = f"{self.url}/api/users/{user}/role"
+        response = await self._request("PUT", url, json={"role": role})
+        response.raise_for_status()
+
+    async def set_channel(
+        self,
+        channel: str,
+        mirror_api_key: str = "",
+        register_mirror: bool = False,
+        **kwargs,
+    ) -> None:
+        url = f"{self.url}/api/channels"
+        params: Dict[str, Union[str, bool]] = {
+            "mirror_api_key": mirror_api_key,
+            "register_mirror": register_mirror,
+        }
+        response = await self._request(
+            "POST", url, json={"name": channel, **kwargs}, params=params
+        )
+        response.raise_for_status()
+
+    async def delete_channel(self, channel: str) -> None:
+        url = f"{self.url}/api/channels/{channel}"
+        response = await self._request("DELETE", url)
+        response.raise_for_status()
+
+    async def yield_packages(
+        self,
+        channel: str,
+        query: str = "",
+        limit: int = 20,
+        order_by: str = "",
+        platform: Optional[str] = None,
+        name_prefix: str = "",
+        changed_since: Optional[str] = None,
+    ) -> AsyncIterator[Package]:
+        since = _parse_timestamp(changed_since) if changed_since else None
+        if since is not None and not order_by:
+            order_by = _ORDER_BY_LATEST_CHANGE
+        url = f"{self.url}/api/paginated/channels/{channel}/packages"
+        params: Dict[str, Union[str, int]] = {
+            "q": query or name_prefix,
+            "order_by": order_by,
+        }
+        async for package_json in self._yield_paginated(
+            url=url, params=params, limit=limit
+        ):
+            if (
+                since is not None
+                and _parse_timestamp(package_json["latest_change"]) <= since
+            ):
+                if order_by == _ORDER_BY_LATEST_CHANGE:
+                    break
+                continue
+            if _package_matches(package_json, platform, name_prefix):
+                yield _decode_package(package_json)
+
+    async def yield_channel_files(self, channel: str) -> AsyncIterator[ChannelFile]:
+        base_url = f"{self.url}/get/{channel}"
+        response = await self._request("GET", f"{base_url}/channeldata.json")
+        if response.status_code == 404:
+            return
+        response.raise_for_status()
+        for subdir in response.json().get("subdirs", []):
+            response = await self._request("GET", f"{base_url}/{subdir}/repodata.json")
+            response.raise_for_status()
+            repodata = response.json()
+            for key in ("packages", "packages.conda"):
+                for filename, info in repodata.get(key, {}).items():
+                    yield ChannelFile(
+                        subdir=subdir,
+                        filename=filename,
+                        sha256=info["sha256"],
+                        size=info.get("size"),
+                    )
+
+    async def post_file_to_channel(
+        self, channel: str, file: Path, force: bool = False, validate: bool = False
+    ) -> None:
+        file_path = Path(file)
+
+        _assert_file_is_package(file_path)
+        if validate:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, validate_package, file_path)
+
+        response = await self._upload_file(channel, file_path, force=force)
+        response.raise_for_status()
+
+    async def post_files_to_channel(
+        self,
+        channel: str,
+        files: Iterable[Union[str, Path]],
+        force: bool = False,
+        max_workers: int = 8,
+        skip_existing: bool = False,
+        validate: bool = False,
+    ) -> List[FileResult]:
+        """Upload several package files to a channel concurrently.
+
+        See `QuetzClient.post_files_to_channel`; at most `max_workers` uploads
+        are in flight at the same time.
+        """
+        if isinstance(files, (str, Path)):
+            files = [files]
+        file_paths = [Path(file) for file in files]
+
+        existing: Dict[str, Set[str]] = {}
+        if skip_existing:
+            async for channel_file in self.yield_channel_files(channel):
+                existing.setdefault(channel_file.filename, set()).add(
+                    channel_file.sha256
+                )
+
+        semaphore = asyncio.Semaphore(max_workers)
+        loop = asyncio.get_running_loop()
+
+        async def upload(file_path: Path) -> FileResult:
+            async with semaphore:
+                try:
+                    _assert_file_is_package(file_path)
+                    if validate:
+                        await loop.run_in_executor(None, validate_package, file_path)
+                    upload_hash = await loop.run_in_executor(
+                        None, _sha256_of_file, file_path
+                    )
+                    if upload_hash in existing.get(file_path.name, ()):
+                        return FileResult(file_path, "skipped")
+                    response = await self._upload_file(
+                        channel, file_path, force=force, sha256=upload_hash
+                    )
+                except (httpx.HTTPError, OSError, ValueError) as e:
+                    return FileResult(file_path, "error", error=str(e))
+            if response.is_error:
+                return FileResult(
+                    file_path,
+                    "error",
+                    status_code=response.status_code,
+                    error=response.text,
+                )
+            return FileResult(file_path, "success", status_code=response.status_code)
+
+        return list(await asyncio.gather(*(upload(f) for f in file_paths)))
+
+    async def _upload_file(
+        self,
+        channel: str,
+        file_path: Path,
+        force: bool = False,
+        sha256: Optional[str] = None,
+    ) -> httpx.Response:
+        url = f"{self.url}/api/channels/{channel}/upload/{file_path.name}"
+
+        if sha256 is None:
+            loop = asyncio.get_running_loop()
+            sha256 = await loop.run_in_executor(None, _sha256_of_file, file_path)
+
+        params: Dict[str, Union[str, int]] = {
+            "force": force,
+            "sha256": sha256,
+        }
+
+        return await self._request(
+            "POST",
+            url,
+            content_factory=lambda: _read_chunks(file_path),
+            params=params,
+        )
@@ -0,0 +1,145 @@
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional, Union
+
+
+@dataclass(frozen=True)
+class CacheEntry:
+    body: Any
+    etag: Optional[str]
+    last_modified: Optional[str]
+    stored_at: float
+
+
+class ResponseCache(ABC):
+    """Base class for caches of decoded JSON responses.
+
+    Entries younger than `ttl` seconds are served without contacting the
+    server. Older entries are revalidated with `If-None-Match` /
+    `If-Modified-Since` if the server sent an `ETag` or `Last-Modified` header.
+    At most `max_entries` entries are kept; the least recently used ones are
+    evicted first.
+    """
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.stored_at < self.ttl
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[CacheEntry]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, entry: CacheEntry) -> None:
+        ...
+
+    @abstractmethod
+    def invalidate(self, prefix: str = "") -> None:
+        """Drop all entries whose key (the request URL) starts with `prefix`"""
+
+
+class MemoryCache(ResponseCache):
+    """In-process LRU cache, shared between threads"""
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 1024):
+        super().__init__(ttl=ttl, max_entries=max_entries)
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, prefix: str = "") -> None:
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+
+
+class SQLiteCache(ResponseCache):
+    """LRU cache persisted in an SQLite database, shared between processes"""
+
+    def __init__(
+        self, path: Union[str, Path], ttl: float = 60.0, max_entries: int = 1024
+    ):
+        import sqlite3
+
+        super().__init__(ttl=ttl, max_entries=max_entries)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    body TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    stored_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT body, etag, last_modified, stored_at FROM responses "
+                "WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                (time.time(), key),
+            )
+        body, etag, last_modified, stored_at = row
+        return CacheEntry(json.loads(body), etag, last_modified, stored_at)
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    json.dumps(entry.body),
+                    entry.etag,
+                    entry.last_modified,
+                    entry.stored_at,
+                    time.time(),
+                ),
+            )
+            self._connection.execute(
+                "DELETE FROM responses WHERE key NOT IN "
+                "(SELECT key FROM responses ORDER BY accessed_at DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def invalidate(self, prefix: str = "") -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM responses WHERE substr(key, 1, ?) = ?",
+                (len(prefix), prefix),
+            )
+
+    def close(self) -> None:
+        self._connection.close()
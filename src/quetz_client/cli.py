@@ -1,10 +1,14 @@
+import atexit
 import os
-from typing import Optional, cast
+import sys
+from typing import TYPE_CHECKING, Optional, cast
 
-import fire
-from requests.adapters import HTTPAdapter, Retry
+if TYPE_CHECKING:
+    from quetz_client.client import QuetzClient
 
-from quetz_client.client import QuetzClient
+# The CLI is started for every single command, so `fire`, `requests` and the
+# client are imported inside the functions that need them. This keeps importing
+# the module cheap and `--help` does not load `requests` at all.
 
 
 def get_client(
@@ -13,7 +17,14 @@ def get_client(
     token: Optional[str] = None,
     insecure: bool = False,
     retry: bool = False,
-) -> QuetzClient:
+    retries: int = 10,
+    pool_maxsize: int = 10,
+    pool_block: bool = False,
+    keep_alive: bool = True,
+    connect_timeout: Optional[float] = None,
+    read_timeout: Optional[float] = None,
+    stats: bool = False,
+) -> "QuetzClient":
     """
     CLI tool to interact with a Quetz server.
 
@@ -33,28 +44,62 @@ def get_client(
     retry: bool
         Allow to retry requests on transient errors and 5xx server
         respones.
+
+    retries: int
+        The total number of retries if `retry` is set.
+
+    pool_maxsize: int
+        The number of connections kept open to the server. Should be at least
+        the number of concurrent workers (e.g. `max_workers` of bulk uploads).
+
+    pool_block: bool
+        Wait for a free connection instead of opening additional ones when all
+        `pool_maxsize` connections are in use.
+
+    keep_alive: bool
+        Reuse connections between requests.
+
+    connect_timeout: Optional[float]
+        Seconds to wait for a connection to the server. Waits forever if unset.
+
+    read_timeout: Optional[float]
+        Seconds to wait for the server to send data. Waits forever if unset.
+
+    stats: bool
+        Print a summary of the requests made (count, latency, bytes, retries and
+        connection reuse per endpoint) to stderr at exit.
     """
+    from quetz_client.client import QuetzClient, default_retry
+
     # Initialize the client (do not force the env variables to be set of help on the
     # subcommands does not work without setting them)
     url = cast(str, url or os.getenv("QUETZ_SERVER_URL", ""))
     token = cast(str, token or os.getenv("QUETZ_API_KEY", ""))
-    client = QuetzClient.from_token(url, token)
+    client = QuetzClient.from_token(
+        url,
+        token,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block,
+        keep_alive=keep_alive,
+        timeout=(connect_timeout, read_timeout),
+        # Retry a total of `retries` times, starting with an initial backoff of
+        # one second.
+        retry=default_retry(total=retries, backoff_factor=1) if retry else None,
+    )
 
     # Configure the client with additional flags passed to the CLI
     client.session.verify = not insecure
-    if retry:
-        # Retry a total of 10 times, starting with an initial backoff of one second.
-        retry_config = Retry(
-            total=10,
-            status_forcelist=range(500, 600),
-            backoff_factor=1,
-            allowed_methods=["GET", "POST", "PUT", "DELETE"],
-        )
-        adapter = HTTPAdapter(max_retries=retry_config)
-        client.session.mount(url, adapter)
+    if stats:
+        from quetz_client.instrumentation import HistogramSink
+
+        sink = HistogramSink()
+        client.instrument(sink)
+        atexit.register(lambda: print(sink.summary(), file=sys.stderr))
 
     return client
 
 
 def main() -> None:
+    import fire
+
     fire.Fire(get_client)
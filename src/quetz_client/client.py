@@ -1,11 +1,58 @@
 import hashlib
-from dataclasses import dataclass
-from itertools import count
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from dataclasses import dataclass, field, fields, is_dataclass, replace
+from datetime import datetime, timezone
+from itertools import count, islice
 from pathlib import Path
-from typing import Dict, Iterator, List, Optional, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+    get_type_hints,
+)
 
 import requests
-from dacite import from_dict
+from requests.adapters import Retry
+
+from quetz_client.cache import CacheEntry, ResponseCache
+from quetz_client.journal import UploadJournal
+from quetz_client.ratelimit import RateLimiter, request_kind
+from quetz_client.transport import (
+    ProgressCallback,
+    ProgressReader,
+    ZeroCopyAdapter,
+    ZeroCopyBody,
+)
+from quetz_client.validation import validate_package
+
+if TYPE_CHECKING:
+    from quetz_client.instrumentation import Instrumentation
+
+# Size of the blocks in which package files are read from disk.
+_CHUNK_SIZE = 1024 * 1024
+
+# Order packages such that the most recently changed ones come first.
+_ORDER_BY_LATEST_CHANGE = "latest_change:desc"
 
 
 @dataclass(frozen=True)
@@ -56,6 +103,119 @@ class Package:
     latest_change: str
 
 
+def _make_decoder(cls: type) -> Callable[[Dict], Any]:
+    """Build a function that turns a JSON object into an instance of `cls`.
+
+    The field names and nested dataclass fields of `cls` are looked up once
+    here instead of for every record, which makes decoding large listings
+    considerably cheaper than with `dacite.from_dict`. Keys of the JSON object
+    that are not fields of `cls` are ignored.
+    """
+    type_hints = get_type_hints(cls)
+    names = [f.name for f in fields(cls)]
+    nested = {
+        name: _make_decoder(type_hints[name])
+        for name in names
+        if is_dataclass(type_hints[name])
+    }
+
+    def decode(data: Dict) -> Any:
+        values = {name: data[name] for name in names}
+        for name, decode_nested in nested.items():
+            values[name] = decode_nested(values[name])
+        return cls(**values)
+
+    return decode
+
+
+_decode_channel = _make_decoder(Channel)
+_decode_user = _make_decoder(User)
+_decode_channel_member = _make_decoder(ChannelMember)
+_decode_package = _make_decoder(Package)
+
+
+def _channel_matches(
+    channel_json: Dict,
+    private: Optional[bool] = None,
+    mirror_mode: Optional[str] = None,
+    name_prefix: str = "",
+) -> bool:
+    """Client-side part of the channel filters, applied before decoding"""
+    return (
+        (private is None or channel_json["private"] == private)
+        and (mirror_mode is None or channel_json["mirror_mode"] == mirror_mode)
+        and channel_json["name"].startswith(name_prefix)
+    )
+
+
+def _package_matches(
+    package_json: Dict, platform: Optional[str] = None, name_prefix: str = ""
+) -> bool:
+    """Client-side part of the package filters, applied before decoding"""
+    return package_json["name"].startswith(name_prefix) and (
+        platform is None or platform in package_json["platforms"]
+    )
+
+
+def _parse_timestamp(value: str) -> datetime:
+    """Parse an ISO timestamp; timestamps without a timezone are taken as UTC"""
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+@dataclass(frozen=True)
+class ChannelFile:
+    subdir: str
+    filename: str
+    sha256: str
+    size: Optional[int]
+
+
+@dataclass(frozen=True)
+class FileResult:
+    file: Path
+    status: str  # one of "success", "skipped" or "error"
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+
+
+
+@dataclass(frozen=True)
+class RoleResult:
+    user: str
+    role: Optional[str]
+    status: str  # one of "success", "unchanged" or "error"
+    error: Optional[str] = None
+
+
+@dataclass
+class MembershipSyncSummary:
+    added: List[str] = field(default_factory=list)
+    updated: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+    errors: Dict[str, str] = field(default_factory=dict)
+    # Users removed by a failed role update whose previous role could not be
+    # restored; they are no longer members of the channel
+    lost: List[str] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        outcomes = {
+            "added": self.added,
+            "updated": self.updated,
+            "removed": self.removed,
+            "unchanged": self.unchanged,
+            "lost": self.lost,
+        }
+        lines = [
+            f"{outcome} ({len(users)}): {', '.join(sorted(users))}".rstrip()
+            for outcome, users in outcomes.items()
+        ]
+        lines += [f"error {user}: {e}" for user, e in sorted(self.errors.items())]
+        return "\n".join(lines)
+
 
 def _assert_file_is_package(file: Path):
     """Raises an error if the file in question does not look like a conda package"""
@@ -66,84 +226,535 @@ def _assert_file_is_package(file: Path):
 
     return False
 
+
+def default_retry(total: int = 10, backoff_factor: float = 1) -> Retry:
+    """Retry transient errors and 5xx responses for all methods the client uses"""
+    return Retry(
+        total=total,
+        status_forcelist=range(500, 600),
+        backoff_factor=backoff_factor,
+        allowed_methods=["GET", "POST", "PUT", "DELETE"],
+    )
+
+
+def _sha256_of_file(file: Path, chunk_size: int = _CHUNK_SIZE) -> str:
+    """Compute the sha256 hex digest of a file in fixed-size chunks"""
+    sha256 = hashlib.sha256()
+    with file.open("rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+@dataclass(frozen=True)
+class AdaptivePageSize:
+    """Bounds for adapting the page size of paginated listings.
+
+    The page size doubles as long as a page is returned within `max_latency`
+    seconds and is at most `max_payload_bytes` large. It is halved when a page
+    exceeds either bound, times out or fails with a 5xx response.
+    """
+
+    min_limit: int = 20
+    max_limit: int = 2000
+    max_latency: float = 1.0
+    max_payload_bytes: int = 4 * 1024 * 1024
+
+    def grow(self, limit: int) -> int:
+        return min(limit * 2, self.max_limit)
+
+    def shrink(self, limit: int) -> int:
+        return max(limit // 2, self.min_limit)
+
+
 @dataclass
 class QuetzClient:
     session: requests.Session
     url: str
+    adaptive_page_size: AdaptivePageSize = field(default_factory=AdaptivePageSize)
+    cache: Optional[ResponseCache] = None
+    # Passed to every request: either a single timeout or (connect, read)
+    timeout: Optional[Union[float, Tuple[Optional[float], Optional[float]]]] = None
+    # Throttles requests per endpoint class and retries throttled responses
+    rate_limiter: Optional[RateLimiter] = None
 
     @classmethod
-    def from_token(cls, url: str, token: str) -> "QuetzClient":
+    def from_token(
+        cls,
+        url: str,
+        token: str,
+        *,
+        pool_connections: int = 10,
+        pool_maxsize: int = 10,
+        pool_block: bool = False,
+        keep_alive: bool = True,
+        timeout: Optional[Union[float, Tuple[Optional[float], Optional[float]]]] = None,
+        retry: Optional[Retry] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+    ) -> "QuetzClient":
+        """Create a client authenticating with an API key.
+
+        `pool_maxsize` is the number of connections kept open per host and
+        should be at least the number of threads using the client concurrently.
+        With `pool_block`, threads wait for a free connection instead of
+        opening (and then discarding) additional ones.
+        """
         session = requests.Session()
         session.headers.update({"X-API-Key": token})
-        return cls(session, url=url)
+        if not keep_alive:
+            session.headers["Connection"] = "close"
+        adapter = ZeroCopyAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            max_retries=retry if retry is not None else 0,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return cls(session, url=url, timeout=timeout, rate_limiter=rate_limiter)
+
+    def instrument(self, *sinks: Callable[[Any], None]) -> "Instrumentation":
+        """Report every request of the client's session to the given sinks.
+
+        See `quetz_client.instrumentation` for the reported `RequestEvent`s and
+        ready-made sinks.
+        """
+        from quetz_client.instrumentation import Instrumentation
+
+        return Instrumentation(sinks).install(self.session)
+
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        if self.rate_limiter is None:
+            return self.session.request(method, url, timeout=self.timeout, **kwargs)
+        kind = request_kind(method, url)
+        body: Any = kwargs.get("data")
+        start = body.tell() if hasattr(body, "seek") else None
+        attempt = 0
+        while True:
+            if start is not None:
+                # Rewind streamed bodies (package uploads) before a retry
+                body.seek(start)  # type: ignore[union-attr]
+            with self.rate_limiter.limit(kind):
+                response = self.session.request(
+                    method, url, timeout=self.timeout, **kwargs
+                )
+            if not self.rate_limiter.backoff(
+                kind, response.status_code, response.headers, attempt
+            ):
+                return response
+            response.close()
+            attempt += 1
 
     def _yield_paginated(
-        self, url: str, params: Dict[str, Union[str, int]], limit: int = 20
+        self,
+        url: str,
+        params: Dict[str, Union[str, int]],
+        limit: int = 20,
+        prefetch: int = 0,
+        adaptive: bool = False,
     ) -> Iterator[Dict]:
+        if adaptive:
+            if prefetch > 0:
+                raise ValueError(
+                    "Adaptive page sizes cannot be combined with prefetch."
+                )
+            yield from self._yield_adaptive(url, params, limit)
+            return
         params = {**params, "limit": limit}
+        if prefetch > 0:
+            yield from self._yield_prefetched(url, params, limit, prefetch)
+            return
         for skip in count(step=limit):
-            params["skip"] = skip
-            response = self.session.get(url=url, params=params)
+            result = self._get_page(url, params, skip)["result"]
+            if not result:
+                break
+            yield from result
+
+    def _yield_prefetched(
+        self,
+        url: str,
+        params: Dict[str, Union[str, int]],
+        limit: int,
+        prefetch: int,
+    ) -> Iterator[Dict]:
+        # The first page tells us how many records there are, so the remaining
+        # pages can be requested concurrently and without a final empty page.
+        first_page = self._get_page(url, params, 0)
+        all_records_count = first_page["pagination"]["all_records_count"]
+
+        def pages() -> Generator[Tuple[int, List[Dict]], None, None]:
+            yield 0, first_page["result"]
+            pending: Deque[Tuple[int, Future]] = deque()
+            with ThreadPoolExecutor(max_workers=prefetch) as executor:
+                try:
+                    for skip in range(limit, all_records_count, limit):
+                        future = executor.submit(self._get_page, url, params, skip)
+                        pending.append((skip, future))
+                        if len(pending) >= prefetch:
+                            skip, future = pending.popleft()
+                            yield skip, future.result()["result"]
+                    while pending:
+                        skip, future = pending.popleft()
+                        yield skip, future.result()["result"]
+                finally:
+                    # Don't fetch pages nobody is going to consume anymore
+                    for _, future in pending:
+                        future.cancel()
+
+        prefetched = pages()
+        try:
+            for skip, result in prefetched:
+                yield from result
+                if len(result) < limit and skip + len(result) < all_records_count:
+                    # The server returned fewer records than requested (e.g.
+                    # it caps the page size), so the offsets of the prefetched
+                    # pages are wrong. Continue one page at a time instead.
+                    prefetched.close()
+                    yield from self._yield_sequential(url, params, skip + len(result))
+                    return
+        finally:
+            prefetched.close()
+
+    def _yield_sequential(
+        self, url: str, params: Dict[str, Union[str, int]], skip: int
+    ) -> Iterator[Dict]:
+        while True:
+            result = self._get_page(url, params, skip)["result"]
+            if not result:
+                break
+            yield from result
+            skip += len(result)
+
+    def _yield_adaptive(
+        self, url: str, params: Dict[str, Union[str, int]], limit: int
+    ) -> Iterator[Dict]:
+        policy = self.adaptive_page_size
+        limit = min(max(limit, policy.min_limit), policy.max_limit)
+        skip = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self._request(
+                    "GET", url=url, params={**params, "limit": limit, "skip": skip}
+                )
+            except requests.Timeout:
+                if limit <= policy.min_limit:
+                    raise
+                limit = policy.shrink(limit)
+                continue
+            if response.status_code >= 500 and limit > policy.min_limit:
+                limit = policy.shrink(limit)
+                continue
             response.raise_for_status()
             result = response.json()["result"]
+            latency = time.perf_counter() - start
             if not result:
                 break
             yield from result
+            # The server may return fewer records than requested
+            skip += len(result)
+            if (
+                latency > policy.max_latency
+                or len(response.content) > policy.max_payload_bytes
+            ):
+                limit = policy.shrink(limit)
+            else:
+                limit = policy.grow(limit)
+
+    def _get_page(
+        self, url: str, params: Dict[str, Union[str, int]], skip: int
+    ) -> Dict:
+        return self._get_json(url=url, params={**params, "skip": skip})
+
+    def _get_json(self, url: str, params: Optional[Dict] = None):
+        """GET a JSON document, going through the response cache if configured"""
+        if self.cache is None:
+            response = self._request("GET", url=url, params=params)
+            response.raise_for_status()
+            return response.json()
 
-    def yield_channels(self, query: str = "", limit: int = 20) -> Iterator[Channel]:
+        key = requests.Request("GET", url, params=params).prepare().url or url
+        api_key = self.session.headers.get("X-API-Key")
+        if api_key:
+            # Listings depend on the permissions of the caller, so clients with
+            # different API keys must not share entries. The hash is appended
+            # to keep the URL a prefix of the key for `invalidate`.
+            if isinstance(api_key, str):
+                api_key = api_key.encode()
+            key += "#" + hashlib.sha256(api_key).hexdigest()[:16]
+        entry = self.cache.get(key)
+        if entry is not None and self.cache.is_fresh(entry):
+            return entry.body
+
+        headers = {}
+        if entry is not None and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry is not None and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        response = self._request("GET", url=url, params=params, headers=headers)
+        if entry is not None and response.status_code == 304:
+            self.cache.set(key, replace(entry, stored_at=time.time()))
+            return entry.body
+        response.raise_for_status()
+        body = response.json()
+        self.cache.set(
+            key,
+            CacheEntry(
+                body=body,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+                stored_at=time.time(),
+            ),
+        )
+        return body
+
+    def invalidate_cache(self, *paths: str) -> None:
+        """Drop cached responses for URLs starting with any of the given paths.
+
+        Without any paths, the whole cache is cleared. The mutating methods of
+        the client call this automatically for the listings they affect.
+        """
+        if self.cache is None:
+            return
+        if not paths:
+            self.cache.invalidate(self.url)
+        for path in paths:
+            self.cache.invalidate(f"{self.url}{path}")
+
+    def yield_channels(
+        self,
+        query: str = "",
+        limit: int = 20,
+        prefetch: int = 0,
+        adaptive: bool = False,
+        private: Optional[bool] = None,
+        mirror_mode: Optional[str] = None,
+        name_prefix: str = "",
+    ) -> Iterator[Channel]:
+        """Yield the channels visible to the user, optionally filtered.
+
+        Quetz only supports a substring search on the channel name (`query`),
+        which is also used to narrow down the listing for `name_prefix`. The
+        other filters are applied while streaming the pages.
+        """
         url = f"{self.url}/api/paginated/channels"
         params: Dict[str, Union[str, int]] = {
-            "q": query,
+            "q": query or name_prefix,
             "public": True,  # include public channels
         }
         for channel_json in self._yield_paginated(
             url=url,
             params=params,
             limit=limit,
+            prefetch=prefetch,
+            adaptive=adaptive,
         ):
-            yield Channel(**channel_json)
+            if _channel_matches(channel_json, private, mirror_mode, name_prefix):
+                yield _decode_channel(channel_json)
 
     def yield_channel_members(self, channel: str) -> Iterator[ChannelMember]:
         url = f"{self.url}/api/channels/{channel}/members"
-        response = self.session.get(url=url)
-        response.raise_for_status()
-        for member_json in response.json():
-            yield from_dict(ChannelMember, member_json)
+        for member_json in self._get_json(url=url):
+            yield _decode_channel_member(member_json)
 
-    def yield_users(self, query: str = "", limit: int = 20) -> Iterator[User]:
+    def yield_users(
+        self,
+        query: str = "",
+        limit: int = 20,
+        prefetch: int = 0,
+        adaptive: bool = False,
+    ) -> Iterator[User]:
         url = f"{self.url}/api/paginated/users"
         params: Dict[str, Union[str, int]] = {
             "q": query,
         }
-        for user_json in self._yield_paginated(url=url, params=params, limit=limit):
-            yield User(**user_json)
+        for user_json in self._yield_paginated(
+            url=url,
+            params=params,
+            limit=limit,
+            prefetch=prefetch,
+            adaptive=adaptive,
+        ):
+            yield _decode_user(user_json)
+
+    def get_username(self) -> str:
+        """Username of the user the client authenticates as"""
+        return self._get_json(url=f"{self.url}/api/me")["user"]["username"]
 
     def get_role(self, user: str) -> Iterator[Role]:
         url = f"{self.url}/api/users/{user}/role"
-        response = self.session.get(
-            url=url,
-        )
-        response.raise_for_status()
-        yield Role(response.json()["role"])
+        yield Role(self._get_json(url=url)["role"])
 
     def set_channel_member(self, user: str, role: Optional[str], channel: str) -> None:
         url = f"{self.url}/api/channels/{channel}/members"
-        response = self.session.post(url=url, json={"username": user, "role": role})
+        response = self._request("POST", url=url, json={"username": user, "role": role})
         response.raise_for_status()
+        self.invalidate_cache(
+            f"/api/channels/{channel}/members", "/api/paginated/channels"
+        )
 
     def delete_channel_member(self, user: str, channel: str) -> None:
         url = f"{self.url}/api/channels/{channel}/members"
-        response = self.session.delete(url=url, params={"username": user})
+        response = self._request("DELETE", url=url, params={"username": user})
         response.raise_for_status()
+        self.invalidate_cache(
+            f"/api/channels/{channel}/members", "/api/paginated/channels"
+        )
+
+    def sync_channel_members(
+        self,
+        channel: str,
+        desired: Dict[str, str],
+        remove_unlisted: bool = True,
+        max_workers: int = 8,
+    ) -> MembershipSyncSummary:
+        """Make the members of a channel match `desired`, a mapping user -> role.
+
+        Only the difference to the current members is applied: missing users
+        are added, users with a different role are updated and, with
+        `remove_unlisted`, users not in `desired` are removed. The changes are
+        applied concurrently and a failing change does not stop the others;
+        failures are reported in the `errors` of the returned summary.
+        Removals start only after all additions and updates are done, so the
+        caller keeps the rights they need (e.g. as channel owner) until then.
+
+        A role is updated by removing and re-adding the member. If re-adding
+        fails, the previous role is restored; members for which that fails as
+        well are reported in `lost`.
+        """
+        current = {m.user.username: m.role for m in self.yield_channel_members(channel)}
+        summary = MembershipSyncSummary()
+
+        def add(user: str) -> None:
+            self.set_channel_member(user, desired[user], channel)
+
+        def update(user: str) -> None:
+            # Quetz refuses to add existing members, so re-add with the new role
+            self.delete_channel_member(user, channel)
+            try:
+                self.set_channel_member(user, desired[user], channel)
+            except requests.RequestException as e:
+                # E.g. the caller may remove members but not grant the new
+                # role: put the user back instead of dropping them
+                try:
+                    self.set_channel_member(user, current[user], channel)
+                except requests.RequestException as restore_error:
+                    summary.lost.append(user)
+                    raise requests.RequestException(
+                        f"removed from the channel, re-adding failed: {e}; "
+                        f"restoring role {current[user]} failed: {restore_error}"
+                    ) from e
+                raise requests.RequestException(
+                    f"kept role {current[user]}, setting {desired[user]} failed: {e}"
+                ) from e
+
+        def remove(user: str) -> None:
+            self.delete_channel_member(user, channel)
+
+        grants = []
+        for user, role in desired.items():
+            if user not in current:
+                grants.append((user, add, summary.added))
+            elif current[user] != role:
+                grants.append((user, update, summary.updated))
+            else:
+                summary.unchanged.append(user)
+        removals = []
+        if remove_unlisted:
+            for user in current.keys() - desired.keys():
+                removals.append((user, remove, summary.removed))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for changes in (grants, removals):
+                futures = {
+                    executor.submit(apply, user): (user, done)
+                    for user, apply, done in changes
+                }
+                for future in as_completed(futures):
+                    user, done = futures[future]
+                    try:
+                        future.result()
+                    except requests.RequestException as e:
+                        summary.errors[user] = str(e)
+                    else:
+                        done.append(user)
+        return summary
 
     def set_role(self, user: str, role: Optional[str]) -> None:
         url = f"{self.url}/api/users/{user}/role"
         data = {"role": role}
-        response = self.session.put(
+        response = self._request(
+            "PUT",
             url=url,
             json=data,
         )
         response.raise_for_status()
+        self.invalidate_cache(f"/api/users/{user}/role")
+
+    def _map_as_completed(
+        self, fn: Callable[[str], RoleResult], users: Iterable[str], max_workers: int
+    ) -> Iterator[RoleResult]:
+        # Keep a bounded number of requests in flight so that `users` can be a
+        # lazy iterator (e.g. over `yield_users`) of any length.
+        users = iter(users)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {executor.submit(fn, user) for user in islice(users, max_workers)}
+            try:
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                    for user in islice(users, len(done)):
+                        pending.add(executor.submit(fn, user))
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def get_roles(
+        self, users: Iterable[str], max_workers: int = 8
+    ) -> Iterator[RoleResult]:
+        """Yield the role of every user, in the order the responses arrive.
+
+        Up to `max_workers` requests are in flight at the same time. A failed
+        request is reported as a result with status "error".
+        """
+        if isinstance(users, str):
+            users = [users]
+
+        def get(user: str) -> RoleResult:
+            url = f"{self.url}/api/users/{user}/role"
+            try:
+                role = self._get_json(url=url)["role"]
+            except requests.RequestException as e:
+                return RoleResult(user, None, "error", error=str(e))
+            return RoleResult(user, role, "success")
+
+        return self._map_as_completed(get, users, max_workers)
+
+    def set_roles(
+        self, roles: Dict[str, Optional[str]], max_workers: int = 8
+    ) -> Iterator[RoleResult]:
+        """Set several roles concurrently and yield the results as they complete.
+
+        The current role of every user is fetched first and users that already
+        have the requested role are reported as "unchanged" without a change
+        request.
+        """
+
+        def set_(user: str) -> RoleResult:
+            role = roles[user]
+            try:
+                # Not cached: a stale role must not make us skip a change
+                response = self._request("GET", url=f"{self.url}/api/users/{user}/role")
+                response.raise_for_status()
+                if response.json()["role"] == role:
+                    return RoleResult(user, role, "unchanged")
+                self.set_role(user, role)
+            except requests.RequestException as e:
+                return RoleResult(user, role, "error", error=str(e))
+            return RoleResult(user, role, "success")
+
+        return self._map_as_completed(set_, roles, max_workers)
 
     def set_channel(
         self,
@@ -157,47 +768,460 @@ class QuetzClient:
             "mirror_api_key": mirror_api_key,
             "register_mirror": register_mirror,
         }
-        response = self.session.post(
-            url=url, json={"name": channel, **kwargs}, params=params
+        response = self._request(
+            "POST", url=url, json={"name": channel, **kwargs}, params=params
         )
         response.raise_for_status()
+        self.invalidate_cache("/api/paginated/channels", f"/api/channels/{channel}/")
+
+    def update_channel(self, channel: str, **kwargs) -> None:
+        """Change settings of an existing channel, e.g. `private` or `ttl`"""
+        url = f"{self.url}/api/channels/{channel}"
+        response = self._request("PATCH", url=url, json=kwargs)
+        response.raise_for_status()
+        self.invalidate_cache("/api/paginated/channels", f"/api/channels/{channel}/")
+
+    def apply(
+        self,
+        state_file: Union[str, Path],
+        delete_unlisted: bool = False,
+        dry_run: bool = False,
+        max_workers: int = 8,
+    ) -> List[Any]:
+        """Bring channels and their members to the state declared in a JSON file.
+
+        The plan (see `quetz_client.state` for the file format) is executed
+        concurrently, channels before their members. Returns the planned steps
+        with `dry_run`, and otherwise a result per step that contains the step,
+        its outcome and its duration.
+        """
+        from quetz_client.state import execute, load_state, plan
+
+        steps = plan(self, load_state(state_file), delete_unlisted, max_workers)
+        if dry_run:
+            return steps
+        return execute(self, steps, max_workers=max_workers)
 
     def delete_channel(self, channel: str):
         url = f"{self.url}/api/channels/{channel}"
-        response = self.session.delete(
+        response = self._request(
+            "DELETE",
             url=url,
         )
         response.raise_for_status()
+        self.invalidate_cache("/api/paginated/channels", f"/api/channels/{channel}/")
 
     def yield_packages(
-        self, channel: str, query: str = "", limit: int = 20, order_by: str = ""
+        self,
+        channel: str,
+        query: str = "",
+        limit: int = 20,
+        order_by: str = "",
+        prefetch: int = 0,
+        adaptive: bool = False,
+        platform: Optional[str] = None,
+        name_prefix: str = "",
+        changed_since: Optional[str] = None,
     ) -> Iterator[Package]:
+        """Yield the packages of a channel, optionally filtered.
+
+        `query` and `name_prefix` are sent to the server as substring search on
+        the package name, `platform` is checked while streaming the pages. With
+        `changed_since` (an ISO timestamp or date, UTC unless it names a
+        timezone) and no other `order_by`, packages are listed by descending
+        `latest_change` and paging stops at the first package that is not
+        newer.
+        """
+        since = _parse_timestamp(changed_since) if changed_since else None
+        if since is not None and not order_by:
+            order_by = _ORDER_BY_LATEST_CHANGE
         url = f"{self.url}/api/paginated/channels/{channel}/packages"
         params: Dict[str, Union[str, int]] = {
-            "q": query,
+            "q": query or name_prefix,
             "order_by": order_by,
         }
-        for user_json in self._yield_paginated(url=url, params=params, limit=limit):
-            yield Package(**user_json)
+        for package_json in self._yield_paginated(
+            url=url,
+            params=params,
+            limit=limit,
+            prefetch=prefetch,
+            adaptive=adaptive,
+        ):
+            if (
+                since is not None
+                and _parse_timestamp(package_json["latest_change"]) <= since
+            ):
+                if order_by == _ORDER_BY_LATEST_CHANGE:
+                    break
+                continue
+            if _package_matches(package_json, platform, name_prefix):
+                yield _decode_package(package_json)
+
+    def yield_changed_packages(
+        self, channel: str, since: Optional[str] = None, limit: int = 20
+    ) -> Iterator[Package]:
+        """Yield the packages of a channel that changed after `since`.
+
+        `since` is an ISO timestamp or date, UTC unless it names a timezone.
+        Packages are listed by descending `latest_change`, so paging stops at
+        the first package that is not newer than `since`. Without `since`, all
+        packages are yielded.
+        """
+        return self.yield_packages(
+            channel, limit=limit, order_by=_ORDER_BY_LATEST_CHANGE, changed_since=since
+        )
+
+    def sync_packages(
+        self, channels: Iterable[str], state_file: Union[str, Path]
+    ) -> Dict[str, List[Package]]:
+        """Return the packages per channel that changed since the previous sync.
+
+        The newest `latest_change` seen in every channel is stored in
+        `state_file` and used as starting point of the next sync, so the work
+        per run depends on the number of changes rather than on channel size.
+        """
+        if isinstance(channels, str):
+            channels = [channels]
+        state_path = Path(state_file)
+        state: Dict[str, str] = (
+            json.loads(state_path.read_text()) if state_path.exists() else {}
+        )
+
+        changes: Dict[str, List[Package]] = {}
+        for channel in channels:
+            changed = list(
+                self.yield_changed_packages(channel, since=state.get(channel))
+            )
+            if changed:
+                newest = max(changed, key=lambda p: _parse_timestamp(p.latest_change))
+                state[channel] = newest.latest_change
+            changes[channel] = changed
+
+        # Write the new state atomically so that an interrupted run doesn't
+        # leave a corrupt state file behind
+        tmp_path = state_path.with_name(state_path.name + ".tmp")
+        tmp_path.write_text(json.dumps(state, indent=2))
+        os.replace(tmp_path, state_path)
+        return changes
+
+    def export(
+        self,
+        kind: str,
+        path: Union[str, Path],
+        channel: Optional[str] = None,
+        format: Optional[str] = None,
+        batch_size: int = 10_000,
+        prefetch: int = 0,
+    ) -> int:
+        """Export "channels", "users", "packages" or "members" to a file.
+
+        The listing is streamed into the file in batches of `batch_size` rows,
+        see `quetz_client.export.export_records` for the supported formats.
+        Packages and members are exported for `channel` or, if not given, for
+        all channels, with the channel name in the first column. Returns the
+        number of exported rows.
+        """
+        from quetz_client.export import (
+            ChannelMemberRecord,
+            ChannelPackage,
+            export_records,
+        )
+
+        def channel_names() -> Iterator[str]:
+            if channel is not None:
+                yield channel
+            else:
+                yield from (c.name for c in self.yield_channels(prefetch=prefetch))
+
+        records: Iterable[Any]
+        record_type: type
+        if kind == "channels":
+            records, record_type = self.yield_channels(prefetch=prefetch), Channel
+        elif kind == "users":
+            records, record_type = self.yield_users(prefetch=prefetch), User
+        elif kind == "packages":
+            records = (
+                ChannelPackage(name, package)
+                for name in channel_names()
+                for package in self.yield_packages(name, prefetch=prefetch)
+            )
+            record_type = ChannelPackage
+        elif kind == "members":
+            records = (
+                ChannelMemberRecord(name, member)
+                for name in channel_names()
+                for member in self.yield_channel_members(name)
+            )
+            record_type = ChannelMemberRecord
+        else:
+            raise ValueError(
+                f"Cannot export {kind}, use channels, users, packages or members."
+            )
+        return export_records(
+            records, record_type, path, format=format, batch_size=batch_size
+        )
+
+    def search(
+        self,
+        query: str = "",
+        platform: Optional[str] = None,
+        index: Optional[Union[str, Path]] = None,
+        refresh: bool = True,
+    ) -> List[Any]:
+        """Search packages of all channels by name in a local metadata index.
+
+        The index (by default one per server in `~/.cache/quetz-client`) is
+        brought up to date with the packages changed since the last search
+        unless `refresh` is False. See `quetz_client.index.MetadataIndex` for
+        more queries.
+        """
+        from quetz_client.index import MetadataIndex
+
+        if index is None:
+            cache_dir = Path(os.getenv("XDG_CACHE_HOME", Path.home() / ".cache"))
+            url_hash = hashlib.sha256(self.url.encode()).hexdigest()[:16]
+            index = cache_dir / "quetz-client" / f"index-{url_hash}.db"
+            index.parent.mkdir(parents=True, exist_ok=True)
+        with MetadataIndex(index) as metadata_index:
+            if refresh:
+                metadata_index.refresh(self)
+            return metadata_index.search(query, platform=platform)
+
+    def yield_channel_files(
+        self, channel: str, platforms: Optional[Iterable[str]] = None
+    ) -> Iterator[ChannelFile]:
+        """Yield all files of a channel as listed in its repodata.
+
+        This needs one request for the channel's subdirs and one per subdir,
+        independent of the number of packages in the channel. `platforms`
+        restricts the listing to the given subdirs.
+        """
+        if isinstance(platforms, str):
+            platforms = [platforms]
+        subdirs = set(platforms) if platforms is not None else None
+        base_url = f"{self.url}/get/{channel}"
+        response = self._request("GET", url=f"{base_url}/channeldata.json")
+        if response.status_code == 404:
+            # Channels without any packages have no channeldata yet
+            return
+        response.raise_for_status()
+        for subdir in response.json().get("subdirs", []):
+            if subdirs is not None and subdir not in subdirs:
+                continue
+            response = self._request("GET", url=f"{base_url}/{subdir}/repodata.json")
+            response.raise_for_status()
+            repodata = response.json()
+            for key in ("packages", "packages.conda"):
+                for filename, info in repodata.get(key, {}).items():
+                    yield ChannelFile(
+                        subdir=subdir,
+                        filename=filename,
+                        sha256=info["sha256"],
+                        size=info.get("size"),
+                    )
 
-    def post_file_to_channel(self, channel: str, file: Path, force: bool = False):
+    def post_file_to_channel(
+        self,
+        channel: str,
+        file: Path,
+        force: bool = False,
+        validate: bool = False,
+        zero_copy: bool = False,
+        progress: Optional[ProgressCallback] = None,
+    ):
+        """Upload a package file; with `validate`, check its contents first.
+
+        See `quetz_client.validation.validate_package` for the checks. With
+        `zero_copy`, the file is sent with `os.sendfile` over plain HTTP and
+        from a memory map otherwise (see `quetz_client.transport`). `progress`
+        is called with an `UploadProgress` (bytes/s and ETA) while sending.
+        """
         file_path = Path(file)
 
         _assert_file_is_package(file_path)
+        if validate:
+            validate_package(file_path)
 
-        url = f"{self.url}/api/channels/{channel}/upload/{file_path.name}"
-        body_bytes = file_path.read_bytes()
+        response = self._upload_file(
+            channel, file_path, force=force, zero_copy=zero_copy, progress=progress
+        )
+        response.raise_for_status()
+        self.invalidate_cache("/api/paginated/channels")
+
+    def post_files_to_channel(
+        self,
+        channel: str,
+        files: Iterable[Union[str, Path]],
+        force: bool = False,
+        max_workers: int = 8,
+        skip_existing: bool = False,
+        journal: Optional[Union[str, Path]] = None,
+        validate: bool = False,
+        zero_copy: bool = False,
+        progress: Optional[ProgressCallback] = None,
+    ) -> List[FileResult]:
+        """Upload several package files to a channel concurrently.
+
+        All uploads share the client's session and thus its connection pool.
+        Failures do not stop the remaining uploads; instead a `FileResult` is
+        returned for every file, in the order in which the files were passed.
 
-        upload_hash = hashlib.sha256(body_bytes).hexdigest()
+        With `skip_existing`, the channel's file index is fetched once and files
+        whose name and sha256 are already present on the server are reported as
+        "skipped" instead of being uploaded again.
+
+        With `journal`, every confirmed upload to this server is recorded in
+        the given file. Re-running the same upload after a failure or restart
+        skips the files recorded there without asking the server, so use
+        `skip_existing` instead if packages may have been deleted since. Quetz
+        accepts a package only as a single request body, so an interrupted
+        file is uploaded again from the start; only batch uploads resume,
+        `post_file_to_channel` does not use a journal.
+
+        With `validate`, the contents of every file are checked before it is
+        uploaded (see `quetz_client.validation.validate_package`), so broken or
+        mislabeled packages are reported as errors without being sent.
+
+        `zero_copy` and `progress` are passed on for every file, see
+        `post_file_to_channel`; `progress` is called from the upload threads.
+        """
+        if isinstance(files, (str, Path)):
+            files = [files]
+        file_paths = [Path(file) for file in files]
+        upload_journal = (
+            UploadJournal(journal, self.url) if journal is not None else None
+        )
+
+        existing: Dict[str, Set[str]] = {}
+        if skip_existing:
+            for channel_file in self.yield_channel_files(channel):
+                existing.setdefault(channel_file.filename, set()).add(
+                    channel_file.sha256
+                )
+
+        def upload(file_path: Path) -> FileResult:
+            try:
+                _assert_file_is_package(file_path)
+                if validate:
+                    validate_package(file_path)
+                upload_hash = _sha256_of_file(file_path)
+                if upload_hash in existing.get(file_path.name, ()) or (
+                    upload_journal is not None
+                    and upload_journal.is_uploaded(channel, upload_hash)
+                ):
+                    return FileResult(file_path, "skipped")
+                response = self._upload_file(
+                    channel,
+                    file_path,
+                    force=force,
+                    sha256=upload_hash,
+                    zero_copy=zero_copy,
+                    progress=progress,
+                )
+                if response.ok and upload_journal is not None:
+                    upload_journal.record_upload(channel, upload_hash, file_path.name)
+            except (requests.RequestException, OSError, ValueError) as e:
+                return FileResult(file_path, "error", error=str(e))
+            if not response.ok:
+                return FileResult(
+                    file_path,
+                    "error",
+                    status_code=response.status_code,
+                    error=response.text,
+                )
+            return FileResult(file_path, "success", status_code=response.status_code)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(upload, file_paths))
+        self.invalidate_cache("/api/paginated/channels")
+        return results
+
+    def download_channel(
+        self,
+        channel: str,
+        dest: Union[str, Path],
+        platforms: Optional[Iterable[str]] = None,
+        max_workers: int = 8,
+    ) -> List[FileResult]:
+        """Download all files of a channel into `dest/<subdir>/<filename>`.
+
+        Files are streamed to disk in fixed-size chunks by up to `max_workers`
+        threads and their sha256 is verified against the channel's repodata
+        while downloading. Files already present in `dest` with a matching
+        sha256 are reported as "skipped". `platforms` restricts the download to
+        the given subdirs, e.g. `["linux-64", "noarch"]`.
+        """
+        channel_files = list(self.yield_channel_files(channel, platforms=platforms))
+
+        def download(channel_file: ChannelFile) -> FileResult:
+            path = Path(dest) / channel_file.subdir / channel_file.filename
+            try:
+                if path.exists() and _sha256_of_file(path) == channel_file.sha256:
+                    return FileResult(path, "skipped")
+                return self._download_file(channel, channel_file, path)
+            except (requests.RequestException, OSError) as e:
+                return FileResult(path, "error", error=str(e))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(download, channel_files))
+
+    def _download_file(
+        self, channel: str, channel_file: ChannelFile, path: Path
+    ) -> FileResult:
+        url = f"{self.url}/get/{channel}/{channel_file.subdir}/{channel_file.filename}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Download next to the target so that an interrupted download never
+        # leaves a truncated file under the final name
+        tmp_path = path.with_name(path.name + ".part")
+        sha256 = hashlib.sha256()
+        with self._request("GET", url=url, stream=True) as response:
+            if not response.ok:
+                return FileResult(
+                    path, "error", status_code=response.status_code, error=response.text
+                )
+            with tmp_path.open("wb") as f:
+                for chunk in response.iter_content(chunk_size=_CHUNK_SIZE):
+                    sha256.update(chunk)
+                    f.write(chunk)
+        if sha256.hexdigest() != channel_file.sha256:
+            tmp_path.unlink()
+            return FileResult(
+                path,
+                "error",
+                status_code=response.status_code,
+                error=f"sha256 mismatch: expected {channel_file.sha256}, "
+                f"got {sha256.hexdigest()}",
+            )
+        os.replace(tmp_path, path)
+        return FileResult(path, "success", status_code=response.status_code)
+
+    def _upload_file(
+        self,
+        channel: str,
+        file_path: Path,
+        force: bool = False,
+        sha256: Optional[str] = None,
+        zero_copy: bool = False,
+        progress: Optional[ProgressCallback] = None,
+    ) -> requests.Response:
+        url = f"{self.url}/api/channels/{channel}/upload/{file_path.name}"
 
         params: Dict[str, Union[str, int]] = {
             "force": force,
-            "sha256": upload_hash,
+            "sha256": sha256 or _sha256_of_file(file_path),
         }
 
-        response = self.session.post(
-            url=url,
-            data=body_bytes,
-            params=params,
-        )
-        response.raise_for_status()
+        # Pass the open file so that requests streams the body instead of
+        # holding the whole package in memory.
+        with file_path.open("rb") as file:
+            body: Any = file
+            if zero_copy:
+                body = ZeroCopyBody(file, file_path, progress)
+            elif progress is not None:
+                body = ProgressReader(file, file_path, progress)
+            return self._request(
+                "POST",
+                url=url,
+                data=body,
+                params=params,
+            )
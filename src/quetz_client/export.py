@@ -0,0 +1,186 @@
+import csv
+import json
+from dataclasses import dataclass, fields, is_dataclass
+from itertools import islice
+from pathlib import Path
+from typing import Any, Iterable, Iterator, List, Optional, Tuple, Union, get_type_hints
+
+from quetz_client.client import ChannelMember, Package
+
+# Output formats by file suffix. Arrow and Parquet require pyarrow.
+_FORMATS_BY_SUFFIX = {
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".csv": "csv",
+    ".jsonl": "jsonl",
+}
+
+
+@dataclass(frozen=True)
+class ChannelPackage:
+    channel: str
+    package: Package
+
+
+@dataclass(frozen=True)
+class ChannelMemberRecord:
+    channel: str
+    member: ChannelMember
+
+
+def _columns(record_type: type, prefix: str = "") -> List[Tuple[str, Any]]:
+    """Flatten the fields of a dataclass into (column name, type) pairs.
+
+    Nested dataclasses become one column per field, e.g. `user.profile.name`.
+    """
+    type_hints = get_type_hints(record_type)
+    columns = []
+    for f in fields(record_type):
+        field_type = type_hints[f.name]
+        if isinstance(field_type, type) and is_dataclass(field_type):
+            columns.extend(_columns(field_type, prefix=f"{prefix}{f.name}."))
+        else:
+            columns.append((f"{prefix}{f.name}", field_type))
+    return columns
+
+
+def _row(record: Any) -> List[Any]:
+    row = []
+    for f in fields(record):
+        value = getattr(record, f.name)
+        if is_dataclass(value):
+            row.extend(_row(value))
+        else:
+            row.append(value)
+    return row
+
+
+def _batches(records: Iterable[Any], batch_size: int) -> Iterator[List[List[Any]]]:
+    iterator = iter(records)
+    while True:
+        batch = [_row(record) for record in islice(iterator, batch_size)]
+        if not batch:
+            return
+        yield batch
+
+
+def _arrow_type(field_type: Any):
+    import pyarrow as pa
+
+    # Optional[X] is Union[X, None]; all columns are nullable anyway
+    args = [a for a in getattr(field_type, "__args__", ()) if a is not type(None)]
+    origin = getattr(field_type, "__origin__", None)
+    if origin is Union:
+        return _arrow_type(args[0])
+    if origin in (list, List):
+        return pa.list_(_arrow_type(args[0]))
+    scalar_types = {
+        str: pa.string(),
+        int: pa.int64(),
+        bool: pa.bool_(),
+        float: pa.float64(),
+    }
+    return scalar_types[field_type]
+
+
+def arrow_schema(record_type: type):
+    """Return the `pyarrow.Schema` used to export records of `record_type`"""
+    import pyarrow as pa
+
+    return pa.schema(
+        [(name, _arrow_type(field_type)) for name, field_type in _columns(record_type)]
+    )
+
+
+def iter_record_batches(
+    records: Iterable[Any], record_type: type, batch_size: int = 10_000
+) -> Iterator[Any]:
+    """Convert dataclass records into `pyarrow.RecordBatch`es of `batch_size` rows.
+
+    Records are consumed lazily, so at most one batch is held in memory.
+    """
+    import pyarrow as pa
+
+    schema = arrow_schema(record_type)
+    for batch in _batches(records, batch_size):
+        columns = [
+            pa.array(column, type=t) for column, t in zip(zip(*batch), schema.types)
+        ]
+        yield pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def export_records(
+    records: Iterable[Any],
+    record_type: type,
+    path: Union[str, Path],
+    format: Optional[str] = None,
+    batch_size: int = 10_000,
+) -> int:
+    """Write dataclass records to `path` and return the number of rows written.
+
+    `format` is one of "parquet", "arrow", "csv" or "jsonl" and is inferred from
+    the file suffix if not given. Records are written in batches of
+    `batch_size` rows, so memory use does not grow with the number of records.
+    """
+    path = Path(path)
+    if format is None:
+        try:
+            format = _FORMATS_BY_SUFFIX[path.suffix]
+        except KeyError:
+            raise ValueError(
+                f"Cannot infer the export format from {path}. Use one of "
+                f"{list(_FORMATS_BY_SUFFIX)} or pass the format explicitly."
+            ) from None
+
+    if format in ("parquet", "arrow"):
+        return _export_arrow(records, record_type, path, format, batch_size)
+
+    names = [name for name, _ in _columns(record_type)]
+    n_rows = 0
+    with path.open("w", newline="") as f:
+        if format == "csv":
+            writer = csv.writer(f)
+            writer.writerow(names)
+        elif format != "jsonl":
+            raise ValueError(f"Unknown export format {format}.")
+        for batch in _batches(records, batch_size):
+            if format == "csv":
+                writer.writerows(
+                    [json.dumps(v) if isinstance(v, list) else v for v in row]
+                    for row in batch
+                )
+            else:
+                f.writelines(json.dumps(dict(zip(names, row))) + "\n" for row in batch)
+            n_rows += len(batch)
+    return n_rows
+
+
+def _export_arrow(
+    records: Iterable[Any],
+    record_type: type,
+    path: Path,
+    format: str,
+    batch_size: int,
+) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError(
+            f"Exporting to {format} requires pyarrow. Install it or export to "
+            "csv or jsonl instead."
+        ) from None
+
+    schema = arrow_schema(record_type)
+    writer = (
+        pq.ParquetWriter(str(path), schema)
+        if format == "parquet"
+        else pa.ipc.new_file(str(path), schema)
+    )
+    n_rows = 0
+    with writer:
+        for batch in iter_record_batches(records, record_type, batch_size):
+            writer.write_batch(batch)
+            n_rows += batch.num_rows
+    return n_rows
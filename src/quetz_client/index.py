@@ -0,0 +1,199 @@
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from quetz_client.client import Channel, Package, QuetzClient, _decode_package
+from quetz_client.export import ChannelPackage
+
+
+class MetadataIndex:
+    """Local SQLite index of the channels and packages of a Quetz server.
+
+    `refresh` fetches only the packages that changed since the previous
+    refresh; the query methods run against the local database and do not
+    make any requests. An index belongs to one server and is cleared when it is
+    refreshed from another one.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        with self._connection:
+            self._connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS channels (
+                    name TEXT PRIMARY KEY,
+                    body TEXT NOT NULL,
+                    -- Newest latest_change of the indexed packages
+                    latest_change TEXT
+                );
+                CREATE TABLE IF NOT EXISTS packages (
+                    channel TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    current_version TEXT,
+                    platforms TEXT NOT NULL,
+                    latest_change TEXT,
+                    body TEXT NOT NULL,
+                    PRIMARY KEY (channel, name)
+                );
+                CREATE INDEX IF NOT EXISTS packages_by_name ON packages (name);
+                """
+            )
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def __enter__(self) -> "MetadataIndex":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _use_server(self, url: str) -> None:
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT value FROM meta WHERE key = 'url'"
+            ).fetchone()
+            if row is not None and row[0] == url:
+                return
+            self._connection.execute("DELETE FROM channels")
+            self._connection.execute("DELETE FROM packages")
+            self._connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('url', ?)", (url,)
+            )
+
+    def _store_packages(
+        self, channel: str, packages: List[Package], replace: bool = False
+    ) -> None:
+        with self._lock, self._connection:
+            if replace:
+                self._connection.execute(
+                    "DELETE FROM packages WHERE channel = ?", (channel,)
+                )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO packages VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        channel,
+                        p.name,
+                        p.current_version,
+                        json.dumps(p.platforms),
+                        p.latest_change,
+                        json.dumps(asdict(p)),
+                    )
+                    for p in packages
+                ],
+            )
+            if not packages:
+                return
+            newest = max(
+                (p.latest_change for p in packages), key=datetime.fromisoformat
+            )
+            if not replace:
+                (current,) = self._connection.execute(
+                    "SELECT latest_change FROM channels WHERE name = ?", (channel,)
+                ).fetchone()
+                if current is not None and datetime.fromisoformat(
+                    current
+                ) >= datetime.fromisoformat(newest):
+                    return
+            self._connection.execute(
+                "UPDATE channels SET latest_change = ? WHERE name = ?",
+                (newest, channel),
+            )
+
+    def refresh(self, client: QuetzClient, max_workers: int = 8) -> Dict[str, int]:
+        """Update the index from the server behind `client`.
+
+        Channels are refreshed concurrently. Deleted packages do not show up
+        in the changes, so a channel whose package count differs from the
+        server's after the update is listed again in full. Returns the number
+        of fetched packages per channel.
+        """
+        self._use_server(client.url)
+        channels = {channel.name: channel for channel in client.yield_channels()}
+        with self._lock, self._connection:
+            since = dict(
+                self._connection.execute("SELECT name, latest_change FROM channels")
+            )
+            for name in since.keys() - channels.keys():
+                self._connection.execute("DELETE FROM channels WHERE name = ?", (name,))
+                self._connection.execute(
+                    "DELETE FROM packages WHERE channel = ?", (name,)
+                )
+            self._connection.executemany(
+                "INSERT INTO channels (name, body) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET body = excluded.body",
+                [(c.name, json.dumps(asdict(c))) for c in channels.values()],
+            )
+
+        def refresh_channel(channel: Channel) -> int:
+            changed = list(
+                client.yield_packages(
+                    channel.name, changed_since=since.get(channel.name)
+                )
+            )
+            self._store_packages(channel.name, changed)
+            if self.count_packages(channel.name) == channel.packages_count:
+                return len(changed)
+            packages = list(client.yield_packages(channel.name))
+            self._store_packages(channel.name, packages, replace=True)
+            return len(packages)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            counts = executor.map(refresh_channel, channels.values())
+            return dict(zip(channels, counts))
+
+    def count_packages(self, channel: str) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM packages WHERE channel = ?", (channel,)
+            ).fetchone()[0]
+
+    def channels(self) -> List[str]:
+        with self._lock:
+            rows = self._connection.execute("SELECT name FROM channels ORDER BY name")
+            return [name for name, in rows]
+
+    def channels_with_package(self, name: str) -> List[str]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT channel FROM packages WHERE name = ? ORDER BY channel", (name,)
+            )
+            return [channel for channel, in rows]
+
+    def current_versions(self, name: str) -> Dict[str, str]:
+        """The current version of a package per channel"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT channel, current_version FROM packages WHERE name = ? "
+                "ORDER BY channel",
+                (name,),
+            )
+            return dict(rows)
+
+    def search(
+        self, query: str = "", platform: Optional[str] = None
+    ) -> List[ChannelPackage]:
+        """Packages whose name contains `query`, optionally built for `platform`"""
+        sql = "SELECT channel, body FROM packages WHERE instr(name, ?) > 0"
+        params = [query]
+        if platform is not None:
+            sql += " AND instr(platforms, ?) > 0"
+            params.append(json.dumps(platform))
+        with self._lock:
+            rows = self._connection.execute(sql + " ORDER BY name, channel", params)
+            return [
+                ChannelPackage(channel, _decode_package(json.loads(body)))
+                for channel, body in rows
+            ]
@@ -0,0 +1,345 @@
+import re
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Tuple
+from urllib.parse import urlparse
+
+import requests
+
+# Path patterns of the Quetz API and the endpoint templates they are reported as.
+# More specific patterns have to come first.
+_ENDPOINT_TEMPLATES = [
+    (r"/api/paginated/channels", "/api/paginated/channels"),
+    (r"/api/paginated/users", "/api/paginated/users"),
+    (
+        r"/api/paginated/channels/[^/]+/packages",
+        "/api/paginated/channels/{channel}/packages",
+    ),
+    (r"/api/channels/[^/]+/members", "/api/channels/{channel}/members"),
+    (
+        r"/api/channels/[^/]+/upload/[^/]+",
+        "/api/channels/{channel}/upload/{filename}",
+    ),
+    (r"/api/channels", "/api/channels"),
+    (r"/api/channels/[^/]+", "/api/channels/{channel}"),
+    (r"/api/users/[^/]+/role", "/api/users/{user}/role"),
+    (r"/get/[^/]+/channeldata.json", "/get/{channel}/channeldata.json"),
+    (r"/get/[^/]+/[^/]+/repodata.json", "/get/{channel}/{subdir}/repodata.json"),
+    (r"/get/[^/]+/[^/]+/[^/]+", "/get/{channel}/{subdir}/{filename}"),
+]
+_ENDPOINT_PATTERNS = [
+    (re.compile(f"{pattern}$"), template) for pattern, template in _ENDPOINT_TEMPLATES
+]
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    float("inf"),
+)
+
+
+def endpoint_template(url: str) -> str:
+    """Map a request URL to its endpoint, e.g. `/api/channels/{channel}/members`"""
+    path = urlparse(url).path
+    for pattern, template in _ENDPOINT_PATTERNS:
+        if pattern.search(path):
+            return template
+    return path
+
+
+@dataclass(frozen=True)
+class RequestEvent:
+    method: str
+    endpoint: str
+    status: int
+    bytes_sent: int
+    # Taken from the Content-Length header, 0 for chunked responses
+    bytes_received: int
+    # Time until the response headers were received, in seconds
+    latency: float
+    retries: int
+    connection_reused: bool
+
+
+Sink = Callable[[RequestEvent], None]
+
+
+class Instrumentation:
+    """Response hook of a `requests.Session` that reports a `RequestEvent` per request.
+
+    Each event is passed to all `sinks`, which are called from the thread that
+    made the request and therefore have to be thread-safe.
+    """
+
+    def __init__(self, sinks: Iterable[Sink] = ()):
+        self.sinks: List[Sink] = list(sinks)
+        self._connections: "weakref.WeakSet" = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def install(self, session: requests.Session) -> "Instrumentation":
+        session.hooks["response"].append(self)
+        return self
+
+    def uninstall(self, session: requests.Session) -> None:
+        session.hooks["response"].remove(self)
+
+    def _is_reused(self, response: requests.Response) -> bool:
+        connection = getattr(response.raw, "connection", None)
+        if connection is None:
+            return False
+        with self._lock:
+            reused = connection in self._connections
+            self._connections.add(connection)
+        return reused
+
+    def __call__(self, response: requests.Response, *args, **kwargs) -> None:
+        request = response.request
+        retries = getattr(response.raw, "retries", None)
+        event = RequestEvent(
+            method=request.method or "",
+            endpoint=endpoint_template(request.url or ""),
+            status=response.status_code,
+            bytes_sent=int(request.headers.get("Content-Length", 0)),
+            bytes_received=int(response.headers.get("Content-Length", 0)),
+            latency=response.elapsed.total_seconds(),
+            retries=len(retries.history) if retries is not None else 0,
+            connection_reused=self._is_reused(response),
+        )
+        for sink in self.sinks:
+            sink(event)
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket containing the `q` quantile"""
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+@dataclass
+class _EndpointStats:
+    requests: int = 0
+    errors: int = 0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    retries: int = 0
+    reused_connections: int = 0
+
+    def __post_init__(self) -> None:
+        self.latency = _Histogram()
+
+
+class HistogramSink:
+    """Aggregate events per method and endpoint in memory.
+
+    Latencies are kept in fixed buckets, so memory use does not depend on the
+    number of requests.
+    """
+
+    def __init__(self) -> None:
+        self.stats: Dict[Tuple[str, str], _EndpointStats] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event: RequestEvent) -> None:
+        with self._lock:
+            stats = self.stats.setdefault(
+                (event.method, event.endpoint), _EndpointStats()
+            )
+            stats.requests += 1
+            stats.errors += event.status >= 400
+            stats.bytes_sent += event.bytes_sent
+            stats.bytes_received += event.bytes_received
+            stats.retries += event.retries
+            stats.reused_connections += event.connection_reused
+            stats.latency.observe(event.latency)
+
+    def summary(self) -> str:
+        header = (
+            "method",
+            "endpoint",
+            "requests",
+            "errors",
+            "retries",
+            "reused",
+            "sent",
+            "received",
+            "mean",
+            "p50<=",
+            "p99<=",
+        )
+        rows = [header]
+        with self._lock:
+            for (method, endpoint), s in sorted(self.stats.items()):
+                rows.append(
+                    (
+                        method,
+                        endpoint,
+                        str(s.requests),
+                        str(s.errors),
+                        str(s.retries),
+                        f"{s.reused_connections / s.requests:.0%}",
+                        _format_bytes(s.bytes_sent),
+                        _format_bytes(s.bytes_received),
+                        f"{s.latency.sum / s.requests * 1000:.1f}ms",
+                        _format_bound(s.latency.quantile(0.5)),
+                        _format_bound(s.latency.quantile(0.99)),
+                    )
+                )
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        return "\n".join(
+            "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+            for row in rows
+        )
+
+
+def _format_bound(seconds: float) -> str:
+    if seconds == float("inf"):
+        return f">{LATENCY_BUCKETS[-2]:.0f}s"
+    return f"{seconds * 1000:.0f}ms"
+
+
+def _format_bytes(n: int) -> str:
+    if n < 1024:
+        return f"{n}B"
+    if n < 1024**2:
+        return f"{n / 1024:.1f}KB"
+    return f"{n / 1024**2:.1f}MB"
+
+
+class PrometheusSink(HistogramSink):
+    """Expose the aggregated events in the Prometheus text format"""
+
+    def render(self) -> str:
+        lines = []
+
+        def metric(name: str, kind: str, help: str, samples: List[str]) -> None:
+            lines.append(f"# HELP quetz_client_{name} {help}")
+            lines.append(f"# TYPE quetz_client_{name} {kind}")
+            lines.extend(f"quetz_client_{sample}" for sample in samples)
+
+        with self._lock:
+            items = sorted(self.stats.items())
+            labels = {key: f'method="{key[0]}",endpoint="{key[1]}"' for key, _ in items}
+            metric(
+                "requests_total",
+                "counter",
+                "Number of HTTP requests.",
+                [f"requests_total{{{labels[k]}}} {s.requests}" for k, s in items],
+            )
+            metric(
+                "request_errors_total",
+                "counter",
+                "Number of HTTP requests with a 4xx or 5xx response.",
+                [f"request_errors_total{{{labels[k]}}} {s.errors}" for k, s in items],
+            )
+            metric(
+                "request_retries_total",
+                "counter",
+                "Number of retried HTTP requests.",
+                [f"request_retries_total{{{labels[k]}}} {s.retries}" for k, s in items],
+            )
+            metric(
+                "request_sent_bytes_total",
+                "counter",
+                "Size of the request bodies.",
+                [
+                    f"request_sent_bytes_total{{{labels[k]}}} {s.bytes_sent}"
+                    for k, s in items
+                ],
+            )
+            metric(
+                "request_received_bytes_total",
+                "counter",
+                "Size of the response bodies.",
+                [
+                    f"request_received_bytes_total{{{labels[k]}}} {s.bytes_received}"
+                    for k, s in items
+                ],
+            )
+            samples = []
+            for key, s in items:
+                cumulative = 0
+                for bound, count in zip(s.latency.buckets, s.latency.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    samples.append(
+                        f'request_duration_seconds_bucket{{{labels[key]},le="{le}"}} '
+                        f"{cumulative}"
+                    )
+                samples.append(
+                    f"request_duration_seconds_sum{{{labels[key]}}} {s.latency.sum}"
+                )
+                samples.append(
+                    f"request_duration_seconds_count{{{labels[key]}}} "
+                    f"{s.latency.count}"
+                )
+            metric(
+                "request_duration_seconds",
+                "histogram",
+                "Time until the response headers were received.",
+                samples,
+            )
+        return "\n".join(lines) + "\n"
+
+
+class OpenTelemetrySink:
+    """Record every request as an OpenTelemetry client span.
+
+    Requires the `opentelemetry-api` package; spans are sent to the tracer
+    provider configured by the application.
+    """
+
+    def __init__(self, tracer=None):
+        from opentelemetry import trace
+
+        self._trace = trace
+        self.tracer = tracer or trace.get_tracer("quetz_client")
+
+    def __call__(self, event: RequestEvent) -> None:
+        end_time = time.time_ns()
+        span = self.tracer.start_span(
+            f"{event.method} {event.endpoint}",
+            kind=self._trace.SpanKind.CLIENT,
+            start_time=end_time - int(event.latency * 1e9),
+            attributes={
+                "http.method": event.method,
+                "http.route": event.endpoint,
+                "http.status_code": event.status,
+                "http.request_content_length": event.bytes_sent,
+                "http.response_content_length": event.bytes_received,
+                "http.retry_count": event.retries,
+                "quetz_client.connection_reused": event.connection_reused,
+            },
+        )
+        if event.status >= 400:
+            span.set_status(self._trace.Status(self._trace.StatusCode.ERROR))
+        span.end(end_time=end_time)
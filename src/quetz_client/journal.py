@@ -0,0 +1,43 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Union
+
+
+class UploadJournal:
+    """Record of confirmed uploads, persisted as JSON and keyed by sha256.
+
+    The journal is updated after every confirmed upload, so a batch upload
+    that was interrupted by a network failure or a restart of the process can
+    resume with the first file that has not been confirmed yet. Entries are
+    scoped to the server at `url`, but they are never checked against it: a
+    package that was deleted on the server since is still reported as
+    uploaded. Resuming works at file granularity only.
+    """
+
+    def __init__(self, path: Union[str, Path], url: str):
+        self.path = Path(path)
+        self.url = url
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, str]] = (
+            json.loads(self.path.read_text()) if self.path.exists() else {}
+        )
+
+    def _key(self, channel: str, sha256: str) -> str:
+        return f"{self.url}/{channel}/{sha256}"
+
+    def is_uploaded(self, channel: str, sha256: str) -> bool:
+        with self._lock:
+            return self._key(channel, sha256) in self._entries
+
+    def record_upload(self, channel: str, sha256: str, filename: str) -> None:
+        with self._lock:
+            self._entries[self._key(channel, sha256)] = {
+                "channel": channel,
+                "filename": filename,
+            }
+            # Write atomically so that a crash never leaves a corrupt journal
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            tmp_path.write_text(json.dumps(self._entries, indent=2))
+            os.replace(tmp_path, self.path)
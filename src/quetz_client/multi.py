@@ -0,0 +1,197 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TypeVar,
+    Union,
+)
+
+import requests
+
+from quetz_client.client import (
+    Channel,
+    ChannelMember,
+    FileResult,
+    Package,
+    QuetzClient,
+    User,
+)
+from quetz_client.validation import validate_packages
+
+T = TypeVar("T")
+
+# Marks the end of the listing of one server in the merged queue
+_DONE = object()
+
+
+@dataclass(frozen=True)
+class Sourced(Generic[T]):
+    """A listed item together with the URL of the server it came from"""
+
+    source: str
+    item: T
+
+
+@dataclass(frozen=True)
+class ServerResult:
+    url: str
+    status: str  # one of "success" or "error"
+    value: Any = None
+    error: Optional[str] = None
+
+
+@dataclass
+class MultiQuetzClient:
+    """Run the same calls against several Quetz servers concurrently.
+
+    Listings of all servers are merged into one iterator as the pages arrive,
+    with every item tagged with its server. Mutations are applied to all
+    servers at once and report a `ServerResult` per server instead of stopping
+    at the first failing one.
+    """
+
+    clients: List[QuetzClient]
+    # Number of merged items buffered before the listing threads wait
+    buffer_size: int = 1000
+
+    @classmethod
+    def from_token(
+        cls, urls: Iterable[str], token: str, **kwargs
+    ) -> "MultiQuetzClient":
+        """Create a client per URL; `kwargs` are passed to `QuetzClient.from_token`"""
+        return cls([QuetzClient.from_token(url, token, **kwargs) for url in urls])
+
+    def _merge(self, method: str, *args, **kwargs) -> Iterator[Sourced]:
+        items: "queue.Queue[Any]" = queue.Queue(maxsize=self.buffer_size)
+        stop = threading.Event()
+
+        def put(value: Any) -> bool:
+            # Give up once the consumer stopped iterating
+            while not stop.is_set():
+                try:
+                    items.put(value, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce(client: QuetzClient) -> None:
+            try:
+                for item in getattr(client, method)(*args, **kwargs):
+                    if not put(Sourced(client.url, item)):
+                        return
+            except Exception as e:
+                put(e)
+            finally:
+                put(_DONE)
+
+        with ThreadPoolExecutor(max_workers=len(self.clients) or 1) as executor:
+            for client in self.clients:
+                executor.submit(produce, client)
+            try:
+                remaining = len(self.clients)
+                while remaining:
+                    value = items.get()
+                    if value is _DONE:
+                        remaining -= 1
+                    elif isinstance(value, Exception):
+                        raise value
+                    else:
+                        yield value
+            finally:
+                stop.set()
+
+    def _fan_out(self, method: str, *args, **kwargs) -> List[ServerResult]:
+        def call(client: QuetzClient) -> ServerResult:
+            try:
+                value = getattr(client, method)(*args, **kwargs)
+            except (requests.RequestException, OSError, ValueError) as e:
+                return ServerResult(client.url, "error", error=str(e))
+            return ServerResult(client.url, "success", value=value)
+
+        with ThreadPoolExecutor(max_workers=len(self.clients) or 1) as executor:
+            return list(executor.map(call, self.clients))
+
+    def yield_channels(self, **kwargs) -> Iterator[Sourced[Channel]]:
+        return self._merge("yield_channels", **kwargs)
+
+    def yield_channel_members(self, channel: str) -> Iterator[Sourced[ChannelMember]]:
+        return self._merge("yield_channel_members", channel)
+
+    def yield_users(self, **kwargs) -> Iterator[Sourced[User]]:
+        return self._merge("yield_users", **kwargs)
+
+    def yield_packages(self, channel: str, **kwargs) -> Iterator[Sourced[Package]]:
+        return self._merge("yield_packages", channel, **kwargs)
+
+    def set_channel_member(
+        self, user: str, role: Optional[str], channel: str
+    ) -> List[ServerResult]:
+        return self._fan_out("set_channel_member", user, role, channel)
+
+    def delete_channel_member(self, user: str, channel: str) -> List[ServerResult]:
+        return self._fan_out("delete_channel_member", user, channel)
+
+    def set_role(self, user: str, role: Optional[str]) -> List[ServerResult]:
+        return self._fan_out("set_role", user, role)
+
+    def set_channel(self, channel: str, **kwargs) -> List[ServerResult]:
+        return self._fan_out("set_channel", channel, **kwargs)
+
+    def delete_channel(self, channel: str) -> List[ServerResult]:
+        return self._fan_out("delete_channel", channel)
+
+    def post_files_to_channel(
+        self,
+        channel: str,
+        files: Iterable[Union[str, Path]],
+        force: bool = False,
+        max_workers: int = 8,
+        skip_existing: bool = False,
+        validate: bool = False,
+    ) -> Dict[str, List[FileResult]]:
+        """Upload package files to the channel on every server.
+
+        The servers are uploaded to concurrently, each with up to `max_workers`
+        parallel uploads, so replicating a release takes about as long as the
+        slowest server. With `validate`, the files are checked once up front and
+        invalid ones are reported as errors for every server. Returns the
+        `FileResult`s per server URL.
+        """
+        if isinstance(files, (str, Path)):
+            files = [files]
+        file_paths = [Path(file) for file in files]
+        # Validate once instead of once per server
+        invalid = validate_packages(file_paths, max_workers) if validate else {}
+        valid_paths = [f for f in file_paths if f not in invalid]
+
+        def upload(client: QuetzClient) -> List[FileResult]:
+            try:
+                uploaded = client.post_files_to_channel(
+                    channel,
+                    valid_paths,
+                    force=force,
+                    max_workers=max_workers,
+                    skip_existing=skip_existing,
+                )
+            except requests.RequestException as e:
+                # e.g. fetching the file index for `skip_existing` failed
+                return [FileResult(f, "error", error=str(e)) for f in file_paths]
+            results = dict(zip(valid_paths, uploaded))
+            return [
+                results.get(f) or FileResult(f, "error", error=invalid[f])
+                for f in file_paths
+            ]
+
+        with ThreadPoolExecutor(max_workers=len(self.clients) or 1) as executor:
+            results = executor.map(upload, self.clients)
+            return {client.url: result for client, result in zip(self.clients, results)}
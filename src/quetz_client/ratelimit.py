@@ -0,0 +1,163 @@
+import re
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Dict, Iterator, Mapping, Optional
+
+# Statuses with which a server signals that the client should slow down
+_THROTTLED_STATUSES = (429, 503)
+
+
+def request_kind(method: str, url: str) -> str:
+    """Classify a request as "read", "write" or "upload" for rate limiting"""
+    if method == "GET":
+        return "read"
+    if method == "POST" and re.search(r"/api/channels/[^/]+/upload/", url):
+        return "upload"
+    return "write"
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a `Retry-After` header (seconds or an HTTP date) into seconds"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class TokenBucket:
+    """Thread-safe token bucket handing out reservations instead of blocking.
+
+    `reserve` takes a token and returns how long the caller has to wait before
+    using it, so the same bucket serves threads (`time.sleep`) and coroutines
+    (`asyncio.sleep`) alike.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._paused_until - now)
+
+    def pause(self, seconds: float) -> None:
+        """Hand out no tokens for the next `seconds`, e.g. after a 429 response"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+@dataclass(frozen=True)
+class Limit:
+    # Requests per second, unlimited if None
+    rate: Optional[float] = None
+    burst: int = 1
+    # Maximum number of concurrent requests, unlimited if None
+    max_in_flight: Optional[int] = None
+
+
+class RateLimiter:
+    """Shared client-side rate limiter and concurrency governor.
+
+    Requests are classified as "read", "write" or "upload" (see
+    `request_kind`) and each class has its own `Limit`. When the server
+    responds with 429 or 503, the class is paused for the duration given by
+    the `Retry-After` header (or `default_backoff` seconds) and the request is
+    retried up to `max_retries` times. One limiter can be shared by several
+    clients, threads and the async client.
+    """
+
+    def __init__(
+        self,
+        read: Limit = Limit(),
+        write: Limit = Limit(),
+        upload: Limit = Limit(),
+        max_retries: int = 5,
+        default_backoff: float = 1.0,
+    ):
+        self.limits = {"read": read, "write": write, "upload": upload}
+        self.max_retries = max_retries
+        self.default_backoff = default_backoff
+        self._buckets: Dict[str, Optional[TokenBucket]] = {
+            kind: TokenBucket(limit.rate, limit.burst) if limit.rate else None
+            for kind, limit in self.limits.items()
+        }
+        self._semaphores: Dict[str, Optional[threading.BoundedSemaphore]] = {
+            kind: threading.BoundedSemaphore(limit.max_in_flight)
+            if limit.max_in_flight
+            else None
+            for kind, limit in self.limits.items()
+        }
+        # Used for pausing request classes without a rate
+        self._pauses = {kind: TokenBucket(float("inf")) for kind in self.limits}
+
+    def _reserve(self, kind: str) -> float:
+        bucket = self._buckets[kind]
+        wait = self._pauses[kind].reserve()
+        if bucket is not None:
+            wait = max(wait, bucket.reserve())
+        return wait
+
+    @contextmanager
+    def limit(self, kind: str) -> Iterator[None]:
+        """Wait until a request of `kind` may be sent and hold its slot"""
+        time.sleep(self._reserve(kind))
+        semaphore = self._semaphores[kind]
+        if semaphore is None:
+            yield
+            return
+        with semaphore:
+            yield
+
+    @asynccontextmanager
+    async def limit_async(self, kind: str) -> AsyncIterator[None]:
+        """Like `limit`, but waits without blocking the event loop"""
+        import asyncio
+
+        await asyncio.sleep(self._reserve(kind))
+        semaphore = self._semaphores[kind]
+        if semaphore is None:
+            yield
+            return
+        # The semaphore is shared with threads, so poll instead of awaiting it
+        while not semaphore.acquire(blocking=False):
+            await asyncio.sleep(0.005)
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def backoff(
+        self, kind: str, status: int, headers: Mapping[str, str], attempt: int
+    ) -> bool:
+        """Pause `kind` if the response asks to slow down; return whether to retry"""
+        if status not in _THROTTLED_STATUSES or attempt >= self.max_retries:
+            return False
+        delay = parse_retry_after(headers.get("Retry-After"))
+        if delay is None:
+            delay = self.default_backoff * 2**attempt
+        self._pauses[kind].pause(delay)
+        if self._buckets[kind] is not None:
+            self._buckets[kind].pause(delay)  # type: ignore[union-attr]
+        return True
@@ -0,0 +1,180 @@
+import json
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import requests
+
+from quetz_client.client import QuetzClient
+
+# Channel settings that can be declared in a state file
+CHANNEL_FIELDS = (
+    "description",
+    "private",
+    "size_limit",
+    "ttl",
+    "mirror_channel_url",
+    "mirror_mode",
+)
+
+_CHANNEL_ACTIONS = ("create_channel", "update_channel", "delete_channel")
+
+
+@dataclass(frozen=True)
+class PlanStep:
+    # "create_channel", "update_channel", "delete_channel" or "sync_members"
+    action: str
+    channel: str
+    # Changed settings, or changed roles per user (None for removed members)
+    changes: Dict[str, Any] = field(default_factory=dict)
+    # Complete desired members of the channel for "sync_members"
+    members: Optional[Dict[str, str]] = None
+
+    def __str__(self) -> str:
+        details = ", ".join(f"{key}={value!r}" for key, value in self.changes.items())
+        return f"{self.action} {self.channel}" + (f": {details}" if details else "")
+
+
+@dataclass(frozen=True)
+class StepResult:
+    step: PlanStep
+    status: str  # one of "success", "skipped" or "error"
+    seconds: float
+    error: Optional[str] = None
+
+    def __str__(self) -> str:
+        line = f"{self.status:<7} {self.seconds * 1000:8.1f}ms  {self.step}"
+        return line + (f" ({self.error})" if self.error else "")
+
+
+def load_state(path: Union[str, Path]) -> Dict[str, Dict[str, Any]]:
+    """Read the desired channels from a JSON state file.
+
+    The file maps channel names to their settings (see `CHANNEL_FIELDS`) and
+    optionally their complete list of members:
+
+        {"channels": {"ch": {"private": true, "members": {"alice": "owner"}}}}
+    """
+    channels = json.loads(Path(path).read_text())["channels"]
+    for name, spec in channels.items():
+        unknown = spec.keys() - {*CHANNEL_FIELDS, "members"}
+        if unknown:
+            raise ValueError(
+                f"Unknown settings for channel {name}: {', '.join(sorted(unknown))}"
+            )
+    return channels
+
+
+def plan(
+    client: QuetzClient,
+    channels: Dict[str, Dict[str, Any]],
+    delete_unlisted: bool = False,
+    max_workers: int = 8,
+) -> List[PlanStep]:
+    """Compute the steps that bring the server to the desired `channels`.
+
+    Members are only reconciled for channels that declare them. With
+    `delete_unlisted`, channels missing from `channels` are deleted.
+    """
+    current = {channel.name: channel for channel in client.yield_channels()}
+    with_members = [name for name, spec in channels.items() if "members" in spec]
+    # Quetz makes the user creating a channel its owner, so that membership
+    # has to be planned like any other
+    creator = (
+        client.get_username()
+        if any(name not in current for name in with_members)
+        else None
+    )
+
+    def current_members(name: str) -> Dict[str, str]:
+        if name not in current:
+            return {creator: "owner"} if creator is not None else {}
+        return {m.user.username: m.role for m in client.yield_channel_members(name)}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        members = dict(zip(with_members, executor.map(current_members, with_members)))
+
+    steps = []
+    for name, spec in channels.items():
+        settings = {key: spec[key] for key in CHANNEL_FIELDS if key in spec}
+        if name not in current:
+            steps.append(PlanStep("create_channel", name, settings))
+        else:
+            changed = {
+                key: value
+                for key, value in settings.items()
+                if getattr(current[name], key) != value
+            }
+            if changed:
+                steps.append(PlanStep("update_channel", name, changed))
+        if name in members:
+            desired = spec["members"]
+            changes: Dict[str, Optional[str]] = {
+                user: role
+                for user, role in desired.items()
+                if members[name].get(user) != role
+            }
+            changes.update({user: None for user in members[name].keys() - desired})
+            if changes:
+                steps.append(PlanStep("sync_members", name, changes, members=desired))
+    if delete_unlisted:
+        for name in sorted(current.keys() - channels.keys()):
+            steps.append(PlanStep("delete_channel", name))
+    return steps
+
+
+def _run(client: QuetzClient, step: PlanStep) -> None:
+    if step.action == "create_channel":
+        client.set_channel(step.channel, **step.changes)
+    elif step.action == "update_channel":
+        client.update_channel(step.channel, **step.changes)
+    elif step.action == "delete_channel":
+        client.delete_channel(step.channel)
+    elif step.action == "sync_members":
+        summary = client.sync_channel_members(step.channel, step.members or {})
+        if summary.errors:
+            raise ValueError(
+                "; ".join(f"{user}: {e}" for user, e in summary.errors.items())
+            )
+    else:
+        raise ValueError(f"Unknown action {step.action}")
+
+
+def execute(
+    client: QuetzClient, steps: List[PlanStep], max_workers: int = 8
+) -> List[StepResult]:
+    """Execute the steps of a plan concurrently.
+
+    The members of a channel are synced after the channel was created or
+    updated and skipped if that failed. Returns a result with the duration of
+    every step, in the order of `steps`.
+    """
+
+    def run(step: PlanStep, dependency: Optional["Future[StepResult]"]) -> StepResult:
+        if dependency is not None and dependency.result().status != "success":
+            return StepResult(step, "skipped", 0.0, error="channel step failed")
+        start = time.perf_counter()
+        try:
+            _run(client, step)
+        except (requests.RequestException, ValueError) as e:
+            return StepResult(step, "error", time.perf_counter() - start, str(e))
+        return StepResult(step, "success", time.perf_counter() - start)
+
+    futures: Dict[int, "Future[StepResult]"] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # The executor starts tasks in submission order, so submitting all
+        # channel steps first means member steps never wait on queued tasks.
+        channel_futures = {}
+        for i, step in enumerate(steps):
+            if step.action in _CHANNEL_ACTIONS:
+                futures[i] = channel_futures[step.channel] = executor.submit(
+                    run, step, None
+                )
+        for i, step in enumerate(steps):
+            if step.action not in _CHANNEL_ACTIONS:
+                futures[i] = executor.submit(
+                    run, step, channel_futures.get(step.channel)
+                )
+        return [futures[i].result() for i in range(len(steps))]
@@ -0,0 +1,188 @@
+import mmap
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, Optional, Union
+
+from requests.adapters import HTTPAdapter
+from requests.utils import select_proxy
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+
+# Size of the slices in which zero-copy bodies are sent; progress is reported
+# after every slice.
+_ZERO_COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class UploadProgress:
+    file: Path
+    bytes_sent: int
+    total_bytes: int
+    # Seconds since the upload started
+    elapsed: float
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes_sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Estimated seconds until the upload is complete"""
+        rate = self.bytes_per_second
+        if rate == 0:
+            return None
+        return (self.total_bytes - self.bytes_sent) / rate
+
+
+ProgressCallback = Callable[[UploadProgress], None]
+
+
+class _ProgressReporter:
+    def __init__(
+        self, file: Path, total_bytes: int, callback: Optional[ProgressCallback]
+    ):
+        self.file = file
+        self.total_bytes = total_bytes
+        self.callback = callback
+        self.reset()
+
+    def reset(self) -> None:
+        self.bytes_sent = 0
+        self.start = time.perf_counter()
+
+    def advance(self, n: int) -> None:
+        self.bytes_sent += n
+        if self.callback is not None:
+            self.callback(
+                UploadProgress(
+                    self.file,
+                    self.bytes_sent,
+                    self.total_bytes,
+                    time.perf_counter() - self.start,
+                )
+            )
+
+
+class ProgressReader:
+    """File wrapper reporting the progress of a regular streamed upload"""
+
+    def __init__(self, file: BinaryIO, path: Path, callback: ProgressCallback):
+        self._file = file
+        self._size = os.fstat(file.fileno()).st_size
+        self._progress = _ProgressReporter(path, self._size, callback)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._file.read(size)
+        if data:
+            self._progress.advance(len(data))
+        return data
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        self._progress.reset()
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+
+@dataclass(frozen=True)
+class _FileRegion:
+    """Part of a file that `_SendfileHTTPConnection` passes to `socket.sendfile`"""
+
+    file: BinaryIO
+    offset: int
+    count: int
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class ZeroCopyBody:
+    """Request body that sends a file without copying it through Python.
+
+    Over connections of a `ZeroCopyAdapter` to plain HTTP URLs, the file is
+    handed to `socket.sendfile`, i.e. the kernel sends it straight from the page
+    cache. Everywhere else (HTTPS, other adapters) the body is a sequence of
+    large slices of a memory map of the file, which are passed to the socket
+    without creating intermediate `bytes` objects.
+    """
+
+    def __init__(
+        self,
+        file: BinaryIO,
+        path: Path,
+        progress: Optional[ProgressCallback] = None,
+        chunk_size: int = _ZERO_COPY_CHUNK_SIZE,
+    ):
+        self._file = file
+        self._size = os.fstat(file.fileno()).st_size
+        self._progress = _ProgressReporter(path, self._size, progress)
+        self.chunk_size = chunk_size
+        # Set by `ZeroCopyAdapter` when the request goes out over plain HTTP
+        self.use_sendfile = False
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[Union[_FileRegion, memoryview]]:
+        # Every iteration sends the whole file, so retries start over
+        self._progress.reset()
+        if self._size == 0:
+            return
+        if self.use_sendfile:
+            for offset in range(0, self._size, self.chunk_size):
+                count = min(self.chunk_size, self._size - offset)
+                yield _FileRegion(self._file, offset, count)
+                self._progress.advance(count)
+            return
+        # The map is not closed explicitly: consumers may keep references to
+        # the slices (e.g. to buffer the body), and it is unmapped as soon as
+        # the last one is gone.
+        mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        for offset in range(0, self._size, self.chunk_size):
+            chunk = view[offset : offset + self.chunk_size]
+            yield chunk
+            self._progress.advance(len(chunk))
+
+
+class _SendfileHTTPConnection(HTTPConnection):
+    def send(self, data) -> None:  # type: ignore[no-untyped-def]
+        if isinstance(data, _FileRegion):
+            if self.sock is None:
+                self.connect()
+            self.sock.sendfile(data.file, data.offset, data.count)
+        else:
+            super().send(data)
+
+
+class _SendfileHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _SendfileHTTPConnection
+
+
+class ZeroCopyAdapter(HTTPAdapter):
+    """`HTTPAdapter` sending `ZeroCopyBody`s with `socket.sendfile` over plain HTTP.
+
+    Requests with any other body are sent exactly like by `HTTPAdapter`.
+    """
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            **self.poolmanager.pool_classes_by_scheme,
+            "http": _SendfileHTTPConnectionPool,
+        }
+
+    def send(self, request, *args, **kwargs):  # type: ignore[no-untyped-def]
+        if isinstance(request.body, ZeroCopyBody):
+            # TLS has to encrypt the data in user space, and proxies use their
+            # own pools, so those fall back to the memory-mapped slices.
+            request.body.use_sendfile = request.url.startswith(
+                "http://"
+            ) and not select_proxy(request.url, kwargs.get("proxies"))
+        return super().send(request, *args, **kwargs)
@@ -0,0 +1,122 @@
+import json
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+_INDEX_JSON = "info/index.json"
+
+
+class PackageValidationError(ValueError):
+    """A file is not a valid conda package or does not match its filename"""
+
+
+def _index_from_tar(tar: tarfile.TarFile) -> Optional[Dict]:
+    # Conda packages store `info/` before the payload, so reading the stream
+    # stops long before the bulk of the archive is decompressed.
+    with tar:
+        for member in tar:
+            if member.name == _INDEX_JSON:
+                extracted = tar.extractfile(member)
+                return json.load(extracted) if extracted is not None else None
+    return None
+
+
+def _read_conda_index(file: Path) -> Optional[Dict]:
+    stem = file.name[: -len(".conda")]
+    # Opening the zip file only reads its central directory
+    with zipfile.ZipFile(file) as archive:
+        names = set(archive.namelist())
+        for required in (
+            "metadata.json",
+            f"info-{stem}.tar.zst",
+            f"pkg-{stem}.tar.zst",
+        ):
+            if required not in names:
+                raise PackageValidationError(f"{file} does not contain {required}")
+        try:
+            import zstandard
+        except ImportError:
+            # Without zstandard only the archive layout can be checked
+            return None
+        with archive.open(f"info-{stem}.tar.zst") as compressed:
+            reader = zstandard.ZstdDecompressor().stream_reader(compressed)
+            return _index_from_tar(tarfile.open(fileobj=reader, mode="r|"))
+
+
+def read_index(file: Union[str, Path]) -> Optional[Dict]:
+    """Read `info/index.json` of a package without extracting its payload.
+
+    Returns None for `.conda` files if the optional `zstandard` package is not
+    installed; the layout of the archive is still checked in that case.
+    """
+    file = Path(file)
+    try:
+        if file.name.endswith(".conda"):
+            index = _read_conda_index(file)
+            if index is None:
+                return None
+        elif file.name.endswith(".tar.bz2"):
+            with file.open("rb") as f:
+                index = _index_from_tar(tarfile.open(fileobj=f, mode="r|bz2"))
+        else:
+            raise PackageValidationError(
+                f"{file} does not look like a conda package, "
+                "it should end in .tar.bz2 or .conda"
+            )
+    except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError) as e:
+        raise PackageValidationError(f"{file} is not a valid archive: {e}") from e
+    except json.JSONDecodeError as e:
+        raise PackageValidationError(f"{file} has an invalid {_INDEX_JSON}") from e
+    if index is None:
+        raise PackageValidationError(f"{file} does not contain {_INDEX_JSON}")
+    return index
+
+
+def validate_package(file: Union[str, Path], subdir: Optional[str] = None) -> None:
+    """Check that a file is a conda package matching its filename.
+
+    The name, version and build in `info/index.json` have to match the
+    filename and the index has to name the package's subdir, which has to be
+    `subdir` if given. Raises a `PackageValidationError` otherwise.
+    """
+    file = Path(file)
+    index = read_index(file)
+    if index is None:
+        return
+    missing = [
+        key for key in ("name", "version", "build", "subdir") if key not in index
+    ]
+    if missing:
+        raise PackageValidationError(
+            f"{_INDEX_JSON} of {file} does not contain {', '.join(missing)}"
+        )
+    suffix = ".conda" if file.name.endswith(".conda") else ".tar.bz2"
+    expected = f"{index['name']}-{index['version']}-{index['build']}{suffix}"
+    if file.name != expected:
+        raise PackageValidationError(
+            f"{file} contains the package {expected} according to {_INDEX_JSON}"
+        )
+    if subdir is not None and index["subdir"] != subdir:
+        raise PackageValidationError(
+            f"{file} is built for {index['subdir']}, not for {subdir}"
+        )
+
+
+def validate_packages(
+    files: Iterable[Union[str, Path]], max_workers: int = 8
+) -> Dict[Path, str]:
+    """Validate several packages concurrently and return the errors per file"""
+    file_paths: List[Path] = [Path(file) for file in files]
+
+    def validate(file: Path) -> Optional[str]:
+        try:
+            validate_package(file)
+        except PackageValidationError as e:
+            return str(e)
+        return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        errors = executor.map(validate, file_paths)
+        return {file: error for file, error in zip(file_paths, errors) if error}
@@ -39,6 +39,22 @@ def temporary_package_file() -> Iterator[Path]:
     yield path
 
 
+def channel_json(name: str, **fields) -> dict:
+    """A channel as returned by the channel listings of the server"""
+    return {
+        "name": name,
+        "description": "",
+        "private": False,
+        "size_limit": None,
+        "ttl": 36000,
+        "mirror_channel_url": None,
+        "mirror_mode": None,
+        "members_count": 0,
+        "packages_count": 0,
+        **fields,
+    }
+
+
 @pytest.fixture(scope="module")
 def mock_server():
     return "https://test.server"
@@ -1,6 +1,7 @@
 from dacite import from_dict
+from requests.adapters import HTTPAdapter
 
-from quetz_client.client import Channel, ChannelMember, QuetzClient
+from quetz_client.client import Channel, ChannelMember, Profile, QuetzClient
 
 
 def test_from_token():
@@ -9,6 +10,18 @@ def test_from_token():
     assert quetz_client.session.headers.get("X-API-Key") == token
 
 
+def test_from_token_transport():
+    url = "https://test.server"
+    quetz_client = QuetzClient.from_token(
+        url, "abc", pool_maxsize=32, pool_block=True, timeout=(1, 5)
+    )
+    adapter = quetz_client.session.get_adapter(url)
+    assert isinstance(adapter, HTTPAdapter)
+    assert adapter.poolmanager.connection_pool_kw["maxsize"] == 32
+    assert adapter.poolmanager.connection_pool_kw["block"]
+    assert quetz_client.timeout == (1, 5)
+
+
 def test_yield_channels(client: QuetzClient, three_channels):
     channels = list(client.yield_channels(limit=2, query="c-"))
     assert len(channels) == 3
@@ -31,3 +44,4 @@ def test_yield_users(client: QuetzClient, expected_users):
     user_set = {(user.id, user.username) for user in users}
     expected_set = {(user["id"], user["username"]) for user in expected_users["result"]}
     assert user_set == expected_set
+    assert all(isinstance(user.profile, Profile) for user in users)
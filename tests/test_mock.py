@@ -1,8 +1,39 @@
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import re
+import socket
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+import httpx
 import pytest
+import requests
 
+from quetz_client import cli
+from quetz_client.async_client import AsyncQuetzClient
+from quetz_client.cache import MemoryCache, SQLiteCache
 from quetz_client.client import QuetzClient
+from quetz_client.index import MetadataIndex
+from quetz_client.instrumentation import PrometheusSink, RequestEvent
+from quetz_client.multi import MultiQuetzClient
+from quetz_client.ratelimit import Limit, RateLimiter
+from quetz_client.transport import UploadProgress, ZeroCopyAdapter, ZeroCopyBody
+from quetz_client.validation import (
+    PackageValidationError,
+    validate_package,
+    validate_packages,
+)
 
-from .conftest import temporary_package_file
+from .conftest import channel_json, temporary_package_file
 from pathlib import Path
 
 @pytest.mark.parametrize(
@@ -183,3 +214,1095 @@ def test_mock_post_file_to_channel_invalid_file(
     file = Path("./wrong_suffix.txt")
     with pytest.raises(ValueError):
         mock_client.post_file_to_channel(channel="doesnotmatter", file=file)
+
+
+def test_mock_post_file_to_channel_streams_file(
+    mock_client: QuetzClient,
+    requests_mock,
+    mock_server: str,
+    tmp_path: Path,
+):
+    channel = "a"
+    file = tmp_path / "pkg-1.0-0.conda"
+    content = b"not a real package" * 100_000
+    file.write_bytes(content)
+
+    url = f"{mock_server}/api/channels/{channel}/upload/{file.name}"
+    requests_mock.post(url, json=None)
+
+    mock_client.post_file_to_channel(channel, file)
+
+    last_request = requests_mock.request_history[0]
+    assert last_request.qs["sha256"] == [hashlib.sha256(content).hexdigest()]
+    # The body is handed to requests as a file object rather than a bytes buffer
+    assert not isinstance(last_request.body, bytes)
+
+
+def test_mock_post_files_to_channel(
+    mock_client: QuetzClient,
+    requests_mock,
+    mock_server: str,
+    tmp_path: Path,
+):
+    channel = "a"
+    files = [tmp_path / f"pkg-{i}-0.conda" for i in range(3)]
+    for file in files:
+        file.write_bytes(file.name.encode())
+    invalid_file = tmp_path / "wrong_suffix.txt"
+
+    requests_mock.post(
+        f"{mock_server}/api/channels/{channel}/upload/{files[0].name}", json=None
+    )
+    requests_mock.post(
+        f"{mock_server}/api/channels/{channel}/upload/{files[1].name}",
+        status_code=409,
+    )
+    requests_mock.post(
+        f"{mock_server}/api/channels/{channel}/upload/{files[2].name}", json=None
+    )
+
+    results = mock_client.post_files_to_channel(
+        channel, [*files, invalid_file], max_workers=2
+    )
+
+    assert [r.file for r in results] == [*files, invalid_file]
+    assert [r.status for r in results] == ["success", "error", "success", "error"]
+    assert results[1].status_code == 409
+    assert results[3].status_code is None
+
+
+def run_cli(monkeypatch, mock_server: str, *args: str) -> None:
+    """Run `quetz-client` with the given arguments against the mock server"""
+    monkeypatch.setenv("QUETZ_SERVER_URL", mock_server)
+    monkeypatch.setattr(sys, "argv", ["quetz-client", *args])
+    cli.main()
+
+
+def test_cli_post_files_to_channel(
+    requests_mock, mock_server: str, tmp_path: Path, monkeypatch
+):
+    files = [tmp_path / "pkg-1-0.conda", tmp_path / "pkg-2-0.tar.bz2"]
+    for file in files:
+        file.write_bytes(file.name.encode())
+    upload = requests_mock.post(
+        re.compile(f"{mock_server}/api/channels/a/upload/"), json=None
+    )
+
+    # The list syntax documented in the README
+    run_cli(
+        monkeypatch,
+        mock_server,
+        "post_files_to_channel",
+        "a",
+        json.dumps([str(file) for file in files]),
+    )
+
+    assert sorted(r.path.rsplit("/", 1)[-1] for r in upload.request_history) == [
+        "pkg-1-0.conda",
+        "pkg-2-0.tar.bz2",
+    ]
+
+
+def test_mock_post_files_to_channel_skip_existing(
+    mock_client: QuetzClient,
+    requests_mock,
+    mock_server: str,
+    tmp_path: Path,
+):
+    channel = "a"
+    existing_file = tmp_path / "pkg-1-0.tar.bz2"
+    existing_file.write_bytes(b"existing")
+    changed_file = tmp_path / "pkg-2-0.conda"
+    changed_file.write_bytes(b"changed")
+
+    requests_mock.get(
+        f"{mock_server}/get/{channel}/channeldata.json",
+        json={"subdirs": ["noarch"]},
+    )
+    requests_mock.get(
+        f"{mock_server}/get/{channel}/noarch/repodata.json",
+        json={
+            "packages": {
+                existing_file.name: {
+                    "sha256": hashlib.sha256(b"existing").hexdigest(),
+                    "size": 8,
+                },
+            },
+            "packages.conda": {
+                changed_file.name: {
+                    "sha256": hashlib.sha256(b"outdated").hexdigest(),
+                    "size": 8,
+                },
+            },
+        },
+    )
+    requests_mock.post(
+        f"{mock_server}/api/channels/{channel}/upload/{changed_file.name}", json=None
+    )
+
+    results = mock_client.post_files_to_channel(
+        channel, [existing_file, changed_file], skip_existing=True, force=True
+    )
+
+    assert [r.status for r in results] == ["skipped", "success"]
+    uploads = [r for r in requests_mock.request_history if r.method == "POST"]
+    assert len(uploads) == 1
+
+
+def test_mock_async_client(mock_server: str, expected_packages, tmp_path: Path):
+    channel = "channel1"
+    file = tmp_path / "pkg-1-0.conda"
+    file.write_bytes(b"package")
+    uploads = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == f"/api/paginated/channels/{channel}/packages":
+            skip = int(request.url.params["skip"])
+            return httpx.Response(
+                200,
+                json={
+                    **expected_packages,
+                    "result": expected_packages["result"][skip:],
+                },
+            )
+        if request.url.path == f"/api/channels/{channel}/upload/{file.name}":
+            uploads.append((request.url.params["sha256"], request.read()))
+            return httpx.Response(201)
+        return httpx.Response(404)
+
+    async def run():
+        session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        async with AsyncQuetzClient(session=session, url=mock_server) as client:
+            packages = [p async for p in client.yield_packages(channel)]
+            changed = client.yield_packages(channel, changed_since="2022-06-14")
+            assert len([p async for p in changed]) == len(packages)
+            await client.post_file_to_channel(channel, file)
+        return packages
+
+    packages = asyncio.run(run())
+
+    assert [p.name for p in packages] == [
+        p["name"] for p in expected_packages["result"]
+    ]
+    assert uploads == [(hashlib.sha256(b"package").hexdigest(), b"package")]
+
+
+def test_async_client_timeout(mock_server: str):
+    async def timeouts(**kwargs) -> httpx.Timeout:
+        async with AsyncQuetzClient.from_token(mock_server, "", **kwargs) as client:
+            return client.session.timeout
+
+    # Like QuetzClient, requests do not time out by default
+    assert asyncio.run(timeouts()) == httpx.Timeout(None)
+    assert asyncio.run(timeouts(timeout=30)) == httpx.Timeout(30)
+    assert asyncio.run(timeouts(timeout=(5, None))) == httpx.Timeout(None, connect=5)
+
+
+def test_mock_yield_channels_prefetch(
+    mock_client: QuetzClient,
+    requests_mock,
+    mock_server: str,
+):
+    channels = [channel_json(f"c-{i}") for i in range(5)]
+    for skip in range(0, 5, 2):
+        requests_mock.get(
+            f"{mock_server}/api/paginated/channels?skip={skip}",
+            json={
+                "pagination": {"skip": skip, "limit": 2, "all_records_count": 5},
+                "result": channels[skip : skip + 2],
+            },
+        )
+
+    names = [c.name for c in mock_client.yield_channels(limit=2, prefetch=2)]
+
+    assert names == [c["name"] for c in channels]
+    # No request for the empty page after the last one
+    assert sorted(r.qs["skip"][0] for r in requests_mock.request_history) == [
+        "0",
+        "2",
+        "4",
+    ]
+
+
+def test_mock_yield_channels_prefetch_short_pages(
+    mock_client: QuetzClient,
+    requests_mock,
+    mock_server: str,
+):
+    channels = [channel_json(f"c-{i}") for i in range(7)]
+
+    def page(request, context):
+        # The server returns at most two records per page
+        skip = int(request.qs["skip"][0])
+        return {
+            "pagination": {"skip": skip, "limit": 2, "all_records_count": 7},
+            "result": channels[skip : skip + 2],
+        }
+
+    requests_mock.get(re.compile(f"{mock_server}/api/paginated/channels"), json=page)
+
+    names = [c.name for c in mock_client.yield_channels(limit=3, prefetch=2)]
+
+    assert names == [c["name"] for c in channels]
+
+
+def test_mock_yield_users_adaptive(
+    mock_client: QuetzClient,
+    requests_mock,
+    mock_server: str,
+):
+    users = [
+        {
+            "id": str(i),
+            "username": f"user{i}",
+            "profile": {"name": f"User {i}", "avatar_url": "/avatar.jpg"},
+        }
+        for i in range(100)
+    ]
+    limits = []
+
+    def page(request, context):
+        skip, limit = int(request.qs["skip"][0]), int(request.qs["limit"][0])
+        limits.append(limit)
+        if limit == 80:
+            context.status_code = 503
+            return None
+        return {
+            "pagination": {"skip": skip, "limit": limit, "all_records_count": 100},
+            "result": users[skip : skip + limit],
+        }
+
+    requests_mock.get(re.compile(f"{mock_server}/api/paginated/users"), json=page)
+
+    usernames = [u.username for u in mock_client.yield_users(adaptive=True)]
+
+    assert usernames == [u["username"] for u in users]
+    # The page size doubles after fast pages and is halved on server errors
+    assert limits[:4] == [20, 40, 80, 40]
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_mock_cache(
+    requests_mock,
+    mock_server: str,
+    expected_channel_a_members,
+    backend: str,
+    tmp_path: Path,
+):
+    cache = MemoryCache(ttl=60) if backend == "memory" else SQLiteCache(tmp_path / "db")
+    client = QuetzClient(url=mock_server, session=requests.Session(), cache=cache)
+    url = f"{mock_server}/api/channels/a/members"
+    requests_mock.get(url, json=expected_channel_a_members, headers={"ETag": '"1"'})
+    requests_mock.post(url, json=None)
+
+    first = list(client.yield_channel_members("a"))
+    second = list(client.yield_channel_members("a"))
+    assert first == second
+    assert requests_mock.call_count == 1
+
+    # Mutations invalidate the affected listings
+    client.set_channel_member("carol", "member", "a")
+    list(client.yield_channel_members("a"))
+    assert requests_mock.call_count == 3
+
+    # Stale entries are revalidated with the ETag
+    cache.ttl = 0
+    requests_mock.get(url, status_code=304)
+    assert list(client.yield_channel_members("a")) == first
+    assert requests_mock.last_request.headers["If-None-Match"] == '"1"'
+
+
+def test_mock_cache_scoped_by_api_key(
+    requests_mock, mock_server: str, expected_channel_a_members, tmp_path: Path
+):
+    cache = SQLiteCache(tmp_path / "db")
+    alice = QuetzClient.from_token(mock_server, "alice-key")
+    bob = QuetzClient.from_token(mock_server, "bob-key")
+    alice.cache = bob.cache = cache
+    url = f"{mock_server}/api/channels/a/members"
+    requests_mock.get(url, json=expected_channel_a_members)
+
+    list(alice.yield_channel_members("a"))
+    list(bob.yield_channel_members("a"))
+    list(alice.yield_channel_members("a"))
+    assert [r.headers["X-API-Key"] for r in requests_mock.request_history] == [
+        "alice-key",
+        "bob-key",
+    ]
+
+    # Invalidation still applies to the entries of every API key
+    alice.invalidate_cache("/api/channels/a")
+    list(bob.yield_channel_members("a"))
+    assert requests_mock.call_count == 3
+
+
+def test_mock_sync_packages(
+    mock_client: QuetzClient,
+    requests_mock,
+    mock_server: str,
+    expected_packages,
+    tmp_path: Path,
+):
+    channel = "channel2"
+    packages = [
+        {**expected_packages["result"][0], "name": f"pkg{i}", "latest_change": ts}
+        for i, ts in enumerate(
+            [
+                "2022-06-16T10:00:00+00:00",
+                "2022-06-15T10:00:00+00:00",
+                "2022-06-14T10:00:00+00:00",
+            ]
+        )
+    ]
+
+    def page(request, context):
+        skip, limit = int(request.qs["skip"][0]), int(request.qs["limit"][0])
+        assert request.qs["order_by"] == ["latest_change:desc"]
+        return {
+            "pagination": {"skip": skip, "limit": limit, "all_records_count": 3},
+            "result": packages[skip : skip + limit],
+        }
+
+    requests_mock.get(
+        re.compile(f"{mock_server}/api/paginated/channels/{channel}/packages"),
+        json=page,
+    )
+    state_file = tmp_path / "state.json"
+    state_file.write_text(json.dumps({channel: "2022-06-14T10:00:00+00:00"}))
+
+    changes = mock_client.sync_packages([channel], state_file)
+
+    assert [p.name for p in changes[channel]] == ["pkg0", "pkg1"]
+    assert json.loads(state_file.read_text()) == {channel: packages[0]["latest_change"]}
+    # A second run without changes only needs a single page
+    requests_mock.reset_mock()
+    changes = mock_client.sync_packages([channel], state_file)
+    assert changes[channel] == []
+    assert requests_mock.call_count == 1
+
+    # `since` without a timezone is taken as UTC
+    changed = mock_client.yield_changed_packages(channel, since="2022-06-15")
+    assert [p.name for p in changed] == ["pkg0", "pkg1"]
+
+
+def test_mock_sync_channel_members(
+    mock_client: QuetzClient,
+    requests_mock,
+    mock_server: str,
+    expected_channel_a_members,
+):
+    # alice and bob are owners of channel a
+    url = f"{mock_server}/api/channels/a/members"
+    requests_mock.get(url, json=expected_channel_a_members)
+    requests_mock.post(url, json=None)
+    requests_mock.delete(url, json=None)
+    requests_mock.post(
+        url,
+        additional_matcher=lambda r: r.json()["username"] == "dave",
+        status_code=403,
+    )
+
+    summary = mock_client.sync_channel_members(
+        "a",
+        {"alice": "owner", "bob": "member", "carol": "maintainer", "dave": "member"},
+    )
+
+    assert summary.unchanged == ["alice"]
+    assert summary.updated == ["bob"]
+    assert summary.added == ["carol"]
+    assert summary.removed == []
+    assert set(summary.errors) == {"dave"}
+    deleted = [
+        r.qs["username"] for r in requests_mock.request_history if r.method == "DELETE"
+    ]
+    assert deleted == [["bob"]]
+
+
+def test_cli_sync_channel_members(
+    requests_mock, mock_server: str, expected_channel_a_members, monkeypatch, capsys
+):
+    # alice and bob are owners of channel a
+    url = f"{mock_server}/api/channels/a/members"
+    requests_mock.get(url, json=expected_channel_a_members)
+    requests_mock.post(url, json=None)
+    requests_mock.delete(url, json=None)
+    requests_mock.post(
+        url,
+        additional_matcher=lambda r: r.json()["username"] == "dave",
+        status_code=403,
+    )
+
+    run_cli(
+        monkeypatch,
+        mock_server,
+        "sync_channel_members",
+        "a",
+        "{bob: member, carol: maintainer, dave: member}",
+    )
+
+    *outcomes, error = capsys.readouterr().out.splitlines()
+    assert outcomes == [
+        "added (1): carol",
+        "updated (1): bob",
+        "removed (1): alice",
+        "unchanged (0):",
+        "lost (0):",
+    ]
+    assert error.startswith("error dave: 403 Client Error")
+
+
+@pytest.mark.parametrize("restore_status", [200, 403])
+def test_mock_sync_channel_members_failed_update(
+    mock_client: QuetzClient,
+    requests_mock,
+    mock_server: str,
+    expected_channel_a_members,
+    restore_status: int,
+):
+    # bob may be removed, but making him a member fails
+    url = f"{mock_server}/api/channels/a/members"
+    requests_mock.get(url, json=expected_channel_a_members)
+    requests_mock.delete(url, json=None)
+    requests_mock.post(url, status_code=restore_status, json=None)
+    requests_mock.post(
+        url,
+        additional_matcher=lambda r: r.json()["role"] == "member",
+        status_code=403,
+    )
+
+    summary = mock_client.sync_channel_members("a", {"alice": "owner", "bob": "member"})
+
+    assert summary.updated == []
+    assert set(summary.errors) == {"bob"}
+    posted = [r.json() for r in requests_mock.request_history if r.method == "POST"]
+    assert posted == [
+        {"username": "bob", "role": "member"},
+        {"username": "bob", "role": "owner"},
+    ]
+    if restore_status == 200:
+        assert summary.lost == []
+        assert summary.errors["bob"].startswith("kept role owner")
+    else:
+        assert summary.lost == ["bob"]
+        assert summary.errors["bob"].startswith("removed from the channel")
+
+
+def test_mock_post_files_to_channel_journal(
+    mock_client: QuetzClient,
+    requests_mock,
+    mock_server: str,
+    tmp_path: Path,
+):
+    channel = "a"
+    files = [tmp_path / f"pkg-{i}-0.conda" for i in range(2)]
+    for file in files:
+        file.write_bytes(file.name.encode())
+    journal = tmp_path / "journal.json"
+
+    requests_mock.post(
+        f"{mock_server}/api/channels/{channel}/upload/{files[0].name}", json=None
+    )
+    requests_mock.post(
+        f"{mock_server}/api/channels/{channel}/upload/{files[1].name}",
+        exc=requests.ConnectionError,
+    )
+    results = mock_client.post_files_to_channel(channel, files, journal=journal)
+    assert [r.status for r in results] == ["success", "error"]
+
+    # The second run only uploads the file that failed before
+    requests_mock.post(
+        f"{mock_server}/api/channels/{channel}/upload/{files[1].name}", json=None
+    )
+    results = mock_client.post_files_to_channel(channel, files, journal=journal)
+    assert [r.status for r in results] == ["skipped", "success"]
+
+    # The entries of one server do not apply to another one
+    other_server = "http://other-server"
+    requests_mock.post(re.compile(f"{other_server}/api/channels/{channel}/upload/"))
+    other_client = QuetzClient(url=other_server, session=requests.Session())
+    results = other_client.post_files_to_channel(channel, files, journal=journal)
+    assert [r.status for r in results] == ["success", "success"]
+
+
+def test_mock_download_channel(
+    mock_client: QuetzClient,
+    requests_mock,
+    mock_server: str,
+    tmp_path: Path,
+):
+    channel = "a"
+    contents = {
+        "pkg-1-0.tar.bz2": b"first",
+        "pkg-2-0.conda": b"second",
+        "pkg-3-0.conda": b"third",
+    }
+    requests_mock.get(
+        f"{mock_server}/get/{channel}/channeldata.json",
+        json={"subdirs": ["noarch", "linux-64"]},
+    )
+    requests_mock.get(
+        f"{mock_server}/get/{channel}/noarch/repodata.json",
+        json={
+            "packages": {
+                "pkg-1-0.tar.bz2": {"sha256": hashlib.sha256(b"first").hexdigest()}
+            },
+            "packages.conda": {
+                name: {"sha256": hashlib.sha256(content).hexdigest()}
+                for name, content in contents.items()
+                if name.endswith(".conda")
+            },
+        },
+    )
+    for name, content in contents.items():
+        # The server delivers corrupt data for pkg-3
+        body = b"corrupt" if name == "pkg-3-0.conda" else content
+        requests_mock.get(f"{mock_server}/get/{channel}/noarch/{name}", content=body)
+    (tmp_path / "noarch").mkdir()
+    (tmp_path / "noarch" / "pkg-1-0.tar.bz2").write_bytes(b"first")
+
+    results = mock_client.download_channel(channel, tmp_path, platforms=["noarch"])
+
+    assert [r.status for r in results] == ["skipped", "success", "error"]
+    assert (tmp_path / "noarch" / "pkg-2-0.conda").read_bytes() == b"second"
+    assert not (tmp_path / "noarch" / "pkg-3-0.conda").exists()
+    assert not any(
+        r.url.endswith("linux-64/repodata.json") for r in requests_mock.request_history
+    )
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".jsonl", ".parquet"])
+def test_mock_export_packages(
+    mock_client: QuetzClient,
+    expected_packages,
+    suffix: str,
+    tmp_path: Path,
+):
+    if suffix == ".parquet":
+        pq = pytest.importorskip("pyarrow.parquet")
+    path = tmp_path / f"packages{suffix}"
+
+    n_rows = mock_client.export("packages", path, channel="channel1", batch_size=1)
+
+    assert n_rows == 2
+    names = [p["name"] for p in expected_packages["result"]]
+    if suffix == ".csv":
+        with path.open() as f:
+            rows = list(csv.DictReader(f))
+        assert [r["package.name"] for r in rows] == names
+        assert json.loads(rows[0]["package.platforms"]) == ["linux-64"]
+    elif suffix == ".jsonl":
+        rows = [json.loads(line) for line in path.read_text().splitlines()]
+        assert [r["package.name"] for r in rows] == names
+        assert {r["channel"] for r in rows} == {"channel1"}
+    else:
+        table = pq.read_table(path)
+        assert table.column("package.name").to_pylist() == names
+        assert table.column("package.platforms").to_pylist()[0] == ["linux-64"]
+
+
+def test_mock_instrumentation(
+    requests_mock,
+    mock_server: str,
+    expected_channel_a_members,
+):
+    client = QuetzClient(url=mock_server, session=requests.Session())
+    events: List[RequestEvent] = []
+    prometheus = PrometheusSink()
+    client.instrument(events.append, prometheus)
+    url = f"{mock_server}/api/channels/a/members"
+    requests_mock.get(url, json=expected_channel_a_members)
+    requests_mock.post(url, status_code=409)
+
+    list(client.yield_channel_members("a"))
+    with pytest.raises(requests.HTTPError):
+        client.set_channel_member("alice", "owner", "a")
+
+    assert [(e.method, e.endpoint, e.status) for e in events] == [
+        ("GET", "/api/channels/{channel}/members", 200),
+        ("POST", "/api/channels/{channel}/members", 409),
+    ]
+    assert events[1].bytes_sent == len(requests_mock.last_request.body)
+    metrics = prometheus.render()
+    assert (
+        'quetz_client_requests_total{method="GET",'
+        'endpoint="/api/channels/{channel}/members"} 1'
+    ) in metrics
+    assert (
+        'quetz_client_request_errors_total{method="POST",'
+        'endpoint="/api/channels/{channel}/members"} 1'
+    ) in metrics
+    assert "/api/channels/{channel}/members" in prometheus.summary()
+
+
+def test_mock_rate_limiter(mock_server: str, requests_mock, tmp_path: Path):
+    limiter = RateLimiter(read=Limit(rate=50, burst=1), upload=Limit(max_in_flight=1))
+    client = QuetzClient(
+        url=mock_server, session=requests.Session(), rate_limiter=limiter
+    )
+    channel = "channel1"
+    file = tmp_path / "pkg-1-0.conda"
+    file.write_bytes(b"package")
+    uploads = []
+
+    def upload(request, context):
+        uploads.append(request.body.read())
+        context.status_code = 429 if len(uploads) == 1 else 201
+        context.headers["Retry-After"] = "0"
+
+    requests_mock.post(
+        f"{mock_server}/api/channels/{channel}/upload/{file.name}", content=upload
+    )
+    requests_mock.get(f"{mock_server}/api/users/alice/role", json={"role": "owner"})
+
+    client.post_file_to_channel(channel, file)
+    start = time.monotonic()
+    for _ in range(6):
+        next(client.get_role("alice"))
+
+    # The first read uses the burst, the other five wait for a token each
+    assert time.monotonic() - start >= 5 / 50
+    # The throttled upload is retried with the whole file
+    assert uploads == [b"package", b"package"]
+
+
+def test_mock_async_rate_limiter(mock_server: str, tmp_path: Path):
+    channel = "channel1"
+    file = tmp_path / "pkg-1-0.conda"
+    file.write_bytes(b"package")
+    uploads = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        uploads.append(request.read())
+        if len(uploads) == 1:
+            return httpx.Response(429, headers={"Retry-After": "0"})
+        return httpx.Response(201)
+
+    async def run():
+        session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        limiter = RateLimiter(upload=Limit(max_in_flight=1))
+        async with AsyncQuetzClient(
+            session=session, url=mock_server, rate_limiter=limiter
+        ) as client:
+            await client.post_file_to_channel(channel, file)
+
+    asyncio.run(run())
+
+    assert uploads == [b"package", b"package"]
+
+
+def test_mock_filtered_queries(
+    mock_client: QuetzClient, requests_mock, mock_server: str, expected_packages
+):
+    channels = [
+        channel_json(name, private=private, mirror_mode=mirror_mode)
+        for name, private, mirror_mode in [
+            ("conda-a", True, None),
+            ("conda-b", False, "proxy"),
+            ("my-conda", True, None),
+        ]
+    ]
+    requests_mock.get(
+        f"{mock_server}/api/paginated/channels?skip=0",
+        json={
+            "pagination": {"skip": 0, "limit": 20, "all_records_count": 3},
+            "result": channels,
+        },
+    )
+
+    private = mock_client.yield_channels(private=True, name_prefix="conda")
+    assert [c.name for c in private] == ["conda-a"]
+    # The prefix narrows down the server-side search
+    assert requests_mock.last_request.qs["q"] == ["conda"]
+    proxies = mock_client.yield_channels(mirror_mode="proxy")
+    assert [c.name for c in proxies] == ["conda-b"]
+
+    noarch = mock_client.yield_packages("channel1", platform="noarch")
+    assert [p.name for p in noarch] == ["testpackage2"]
+    changed = mock_client.yield_packages(
+        "channel1", changed_since="2022-06-14T00:00:00+00:00"
+    )
+    assert len(list(changed)) == 2
+    assert requests_mock.last_request.qs["order_by"] == ["latest_change:desc"]
+    unchanged = mock_client.yield_packages(
+        "channel1", changed_since="2022-06-15T00:00:00+00:00"
+    )
+    assert list(unchanged) == []
+    # Timestamps and dates without a timezone are taken as UTC
+    dated = mock_client.yield_packages("channel1", changed_since="2022-06-14")
+    assert len(list(dated)) == 2
+    naive = mock_client.yield_packages("channel1", changed_since="2022-06-14T18:00:00")
+    assert list(naive) == []
+
+
+def test_mock_multi_client(requests_mock, expected_channel_a_members, tmp_path: Path):
+    urls = ["https://eu.quetz.example", "https://us.quetz.example"]
+    client = MultiQuetzClient.from_token(urls, "token")
+    file = tmp_path / "pkg-1-0.conda"
+    file.write_bytes(b"package")
+    for url in urls:
+        requests_mock.get(
+            f"{url}/api/channels/a/members", json=expected_channel_a_members
+        )
+        requests_mock.post(f"{url}/api/channels/a/upload/{file.name}", status_code=201)
+    requests_mock.put(f"{urls[0]}/api/users/alice/role")
+    requests_mock.put(f"{urls[1]}/api/users/alice/role", status_code=403)
+
+    members = list(client.yield_channel_members("a"))
+    results = client.set_role("alice", "owner")
+    uploads = client.post_files_to_channel("a", [file])
+
+    assert sorted((m.source, m.item.user.username) for m in members) == sorted(
+        (url, m["user"]["username"]) for url in urls for m in expected_channel_a_members
+    )
+    assert [(r.url, r.status) for r in results] == [
+        (urls[0], "success"),
+        (urls[1], "error"),
+    ]
+    assert {url: [r.status for r in rs] for url, rs in uploads.items()} == {
+        url: ["success"] for url in urls
+    }
+
+
+# Upper bound for `import quetz_client.cli`, which runs for every CLI command
+CLI_IMPORT_BUDGET_SECONDS = 0.1
+
+
+def test_cli_import_time():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import quetz_client.cli"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| +(\S+)$", line)
+        if match:
+            cumulative[match[2]] = int(match[1]) / 1e6
+
+    assert cumulative["quetz_client.cli"] < CLI_IMPORT_BUDGET_SECONDS
+    for heavy in ("fire", "requests", "urllib3", "asyncio", "sqlite3"):
+        assert heavy not in cumulative
+
+
+def _write_tar_bz2_package(path: Path, index: dict) -> Path:
+    with tarfile.open(path, "w:bz2") as tar:
+        payload = json.dumps(index).encode()
+        info = tarfile.TarInfo("info/index.json")
+        info.size = len(payload)
+        tar.addfile(info, io.BytesIO(payload))
+    return path
+
+
+def test_validate_package(tmp_path: Path):
+    index = {"name": "pkg", "version": "1.0", "build": "0", "subdir": "noarch"}
+    valid = _write_tar_bz2_package(tmp_path / "pkg-1.0-0.tar.bz2", index)
+    mislabeled = _write_tar_bz2_package(tmp_path / "pkg-2.0-0.tar.bz2", index)
+    corrupt = tmp_path / "pkg-3.0-0.tar.bz2"
+    corrupt.write_bytes(b"not a package")
+    conda = tmp_path / "pkg-1.0-0.conda"
+    with zipfile.ZipFile(conda, "w") as archive:
+        archive.writestr("metadata.json", "{}")
+        archive.writestr("pkg-pkg-2.0-0.tar.zst", b"")
+
+    validate_package(valid, subdir="noarch")
+    with pytest.raises(PackageValidationError, match="linux-64"):
+        validate_package(valid, subdir="linux-64")
+    errors = validate_packages([valid, mislabeled, corrupt, conda])
+    assert sorted(errors) == [conda, mislabeled, corrupt]
+    assert "pkg-1.0-0.tar.bz2 according to info/index.json" in errors[mislabeled]
+    assert "not a valid archive" in errors[corrupt]
+    assert "does not contain info-pkg-1.0-0.tar.zst" in errors[conda]
+
+
+def test_mock_post_files_to_channel_validate(
+    mock_client: QuetzClient, mock_server: str, requests_mock, tmp_path: Path
+):
+    index = {"name": "pkg", "version": "1.0", "build": "0", "subdir": "noarch"}
+    valid = _write_tar_bz2_package(tmp_path / "pkg-1.0-0.tar.bz2", index)
+    invalid = _write_tar_bz2_package(tmp_path / "other-1.0-0.tar.bz2", index)
+    upload = requests_mock.post(
+        re.compile(f"{mock_server}/api/channels/channel1/upload/.*"), status_code=201
+    )
+
+    results = mock_client.post_files_to_channel(
+        "channel1", [valid, invalid], validate=True
+    )
+
+    assert [r.status for r in results] == ["success", "error"]
+    assert upload.call_count == 1
+
+
+def test_mock_metadata_index(
+    mock_client: QuetzClient, requests_mock, mock_server: str, expected_packages
+):
+    requests_mock.get(
+        f"{mock_server}/api/paginated/channels?skip=0",
+        json={
+            "pagination": {"skip": 0, "limit": 20, "all_records_count": 2},
+            "result": [
+                channel_json("channel1", packages_count=2),
+                channel_json("channel2", packages_count=1),
+            ],
+        },
+    )
+    requests_mock.get(
+        f"{mock_server}/api/paginated/channels/channel2/packages?skip=0",
+        json={**expected_packages, "result": expected_packages["result"][:1]},
+    )
+
+    with MetadataIndex(":memory:") as index:
+        assert index.refresh(mock_client) == {"channel1": 2, "channel2": 1}
+        # Nothing changed since the first refresh
+        assert index.refresh(mock_client) == {"channel1": 0, "channel2": 0}
+
+        assert index.channels_with_package("testpackage1") == [
+            "channel1",
+            "channel2",
+        ]
+        assert index.current_versions("testpackage2") == {"channel1": "0.0.2"}
+        found = index.search("package", platform="linux-64")
+        assert [(r.channel, r.package.name) for r in found] == [
+            ("channel1", "testpackage1"),
+            ("channel2", "testpackage1"),
+        ]
+
+        # A deleted package is noticed by the changed package count
+        requests_mock.get(
+            f"{mock_server}/api/paginated/channels?skip=0",
+            json={
+                "pagination": {"skip": 0, "limit": 20, "all_records_count": 2},
+                "result": [
+                    channel_json("channel1", packages_count=2),
+                    channel_json("channel2"),
+                ],
+            },
+        )
+        requests_mock.get(
+            f"{mock_server}/api/paginated/channels/channel2/packages?skip=0",
+            json={**expected_packages, "result": []},
+        )
+        index.refresh(mock_client)
+        assert index.channels_with_package("testpackage1") == ["channel1"]
+
+
+def test_mock_get_and_set_roles(
+    mock_client: QuetzClient, requests_mock, mock_server: str
+):
+    roles = {"alice": "owner", "bob": "member", "carol": None}
+    for user, role in roles.items():
+        requests_mock.get(f"{mock_server}/api/users/{user}/role", json={"role": role})
+    requests_mock.get(f"{mock_server}/api/users/dave/role", status_code=404)
+    put = requests_mock.put(re.compile(f"{mock_server}/api/users/.*/role"))
+
+    results = mock_client.get_roles(iter(["alice", "bob", "carol", "dave"]))
+    assert sorted((r.user, r.role, r.status) for r in results) == [
+        ("alice", "owner", "success"),
+        ("bob", "member", "success"),
+        ("carol", None, "success"),
+        ("dave", None, "error"),
+    ]
+
+    results = mock_client.set_roles({"alice": "owner", "bob": "maintainer"})
+    assert sorted((r.user, r.status) for r in results) == [
+        ("alice", "unchanged"),
+        ("bob", "success"),
+    ]
+    assert put.call_count == 1
+    assert put.last_request.json() == {"role": "maintainer"}
+
+
+def test_mock_apply(
+    mock_client: QuetzClient,
+    requests_mock,
+    mock_server: str,
+    expected_channel_a_members,
+    tmp_path: Path,
+    capsys,
+):
+    channel_a = channel_json("a", members_count=2)
+    requests_mock.get(
+        f"{mock_server}/api/paginated/channels?skip=0",
+        json={
+            "pagination": {"skip": 0, "limit": 20, "all_records_count": 1},
+            "result": [channel_a],
+        },
+    )
+    requests_mock.get(
+        f"{mock_server}/api/channels/a/members", json=expected_channel_a_members
+    )
+    requests_mock.patch(f"{mock_server}/api/channels/a")
+    requests_mock.post(f"{mock_server}/api/channels", status_code=201)
+    requests_mock.post(f"{mock_server}/api/channels/a/members", status_code=201)
+    requests_mock.delete(f"{mock_server}/api/channels/a/members")
+    state = {
+        "channels": {
+            "a": {"private": True, "ttl": 36000, "members": {"alice": "owner"}},
+            "b": {"private": False},
+        }
+    }
+    state_file = tmp_path / "state.json"
+    state_file.write_text(json.dumps(state))
+
+    steps = mock_client.apply(state_file, dry_run=True)
+    assert [str(step) for step in steps] == [
+        "update_channel a: private=True",
+        "sync_members a: bob=None",
+        "create_channel b: private=False",
+    ]
+
+    results = mock_client.apply(state_file)
+    assert [(r.step.action, r.status) for r in results] == [
+        ("update_channel", "success"),
+        ("sync_members", "success"),
+        ("create_channel", "success"),
+    ]
+    # Printing is left to the CLI
+    assert capsys.readouterr().out == ""
+    history = [(r.method, r.path) for r in requests_mock.request_history]
+    # The channel is updated before its members are changed
+    assert history.index(("PATCH", "/api/channels/a")) < history.index(
+        ("DELETE", "/api/channels/a/members")
+    )
+
+    state_file.write_text(json.dumps({"channels": {"c": {"colour": "red"}}}))
+    with pytest.raises(ValueError, match="colour"):
+        mock_client.apply(state_file)
+
+
+def test_mock_apply_created_channel_members(
+    mock_client: QuetzClient, requests_mock, mock_server: str, tmp_path: Path
+):
+    requests_mock.get(
+        f"{mock_server}/api/paginated/channels?skip=0",
+        json={
+            "pagination": {"skip": 0, "limit": 20, "all_records_count": 0},
+            "result": [],
+        },
+    )
+    requests_mock.get(
+        f"{mock_server}/api/me",
+        json={
+            "name": "Alice",
+            "avatar_url": "",
+            "user": {"id": "1", "username": "alice"},
+        },
+    )
+    requests_mock.post(f"{mock_server}/api/channels", status_code=201)
+    members_url = f"{mock_server}/api/channels/b/members"
+    # Quetz makes the creator of a channel its owner
+    requests_mock.get(
+        members_url,
+        json=[
+            {
+                "role": "owner",
+                "user": {
+                    "id": "1",
+                    "username": "alice",
+                    "profile": {"name": "Alice", "avatar_url": ""},
+                },
+            }
+        ],
+    )
+    requests_mock.post(members_url, status_code=201)
+    requests_mock.delete(members_url)
+    state_file = tmp_path / "state.json"
+    state_file.write_text(
+        json.dumps(
+            {"channels": {"b": {"members": {"bob": "owner", "carol": "member"}}}}
+        )
+    )
+
+    steps = mock_client.apply(state_file, dry_run=True)
+    assert [str(step) for step in steps] == [
+        "create_channel b",
+        "sync_members b: bob='owner', carol='member', alice=None",
+    ]
+
+    results = mock_client.apply(state_file)
+    assert [r.status for r in results] == ["success", "success"]
+    changes = [
+        (r.method, r.json()["username"] if r.method == "POST" else r.qs["username"][0])
+        for r in requests_mock.request_history
+        if r.path == "/api/channels/b/members" and r.method != "GET"
+    ]
+    # The creator is removed only after the declared members were added
+    assert sorted(changes[:2]) == [("POST", "bob"), ("POST", "carol")]
+    assert changes[2:] == [("DELETE", "alice")]
+
+
+def test_mock_post_file_to_channel_zero_copy(
+    mock_client: QuetzClient, mock_server: str, requests_mock, tmp_path: Path
+):
+    file = tmp_path / "pkg-1-0.conda"
+    file.write_bytes(bytes(range(256)) * 1024)
+    uploads: List[bytes] = []
+
+    def record_upload(request) -> bool:
+        uploads.append(b"".join(request.body))
+        return True
+
+    requests_mock.post(
+        f"{mock_server}/api/channels/channel1/upload/{file.name}",
+        status_code=201,
+        additional_matcher=record_upload,
+    )
+    progress: List[UploadProgress] = []
+
+    mock_client.post_file_to_channel(
+        "channel1", file, zero_copy=True, progress=progress.append
+    )
+
+    assert uploads == [file.read_bytes()]
+    assert progress[-1].bytes_sent == progress[-1].total_bytes == 256 * 1024
+    assert progress[-1].eta == 0
+
+
+def test_upload_progress_eta():
+    assert UploadProgress(Path("x"), 0, 100, 1.0).eta is None
+    # No measurable time has passed yet
+    assert UploadProgress(Path("x"), 10, 100, 0.0).eta is None
+    assert UploadProgress(Path("x"), 25, 100, 1.0).eta == 3.0
+
+
+def test_zero_copy_adapter_sendfile(tmp_path: Path, monkeypatch):
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.append(self.rfile.read(int(self.headers["Content-Length"])))
+            self.send_response(201)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    file = tmp_path / "pkg-1-0.conda"
+    file.write_bytes(bytes(range(256)) * 1024)
+    sendfile_calls = []
+    sendfile = socket.socket.sendfile
+
+    def recording_sendfile(sock, *args, **kwargs):
+        sendfile_calls.append(args)
+        return sendfile(sock, *args, **kwargs)
+
+    monkeypatch.setattr(socket.socket, "sendfile", recording_sendfile)
+
+    try:
+        with file.open("rb") as f:
+            request = requests.Request(
+                "POST",
+                f"http://127.0.0.1:{server.server_address[1]}/",
+                data=ZeroCopyBody(f, file, chunk_size=100_000),
+            ).prepare()
+            # Send with the adapter directly, requests_mock patches the session
+            response = ZeroCopyAdapter().send(request)
+    finally:
+        server.shutdown()
+
+    assert response.status_code == 201
+    assert received == [file.read_bytes()]
+    assert len(sendfile_calls) == 3